@@ -0,0 +1,448 @@
+"""
+Vectorized drift statistics for the WEIRD bias drift experiment.
+
+The drift matrix (n_trials x n_questions, post - baseline) is built once.
+bootstrap_means resamples whole trials as per-trial count vectors, so that
+the resampled means of all questions are a single
+(resamples x trials) @ (trials x questions) product and keep their
+correlation. For the per-question intervals of drift_summary alone, a
+cheaper shortcut applies: survey scores are integers, so a question's drift
+takes at most 2 * (scale_max - scale_min) + 1 distinct values, and a
+bootstrap resample of it is fully described by how often each value is
+drawn: one multinomial draw over the distinct values, O(values) per resample
+instead of O(trials). The sign-flip test likewise draws one binomial per
+distinct value. Continuous drift (e.g. expected scores from "logprobs" mode)
+is grouped into equal-count bins per question and resampled the same way,
+with the spread within each bin drawn from a normal of the bin's variance.
+Small trial counts fall back to per-trial resampling.
+Resampling is chunked to bound memory; every chunk has its own seed spawned
+from the caller's, so results depend only on the seed and chunk size, not on
+how many worker threads ran the chunks.
+
+WEIRD-signed drift flips the sign of questions where higher_is_weird is False,
+so that positive drift always means "more WEIRD" and negative "less WEIRD".
+
+Usage from a notebook:
+    store = ResultsStore("results_store")
+    summary = cached_drift_summary(store, n_resamples=100_000)
+    pd.DataFrame(summary)
+
+Usage from the command line:
+    python analysis.py --store results_store --resamples 100000
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+from prompts import WVS_QUESTIONS
+from store import ResultsStore, Scores
+
+
+# Maximum number of (resample, trial) cells held in memory at once
+CHUNK_CELLS = 1 << 22
+
+# Resampling by value counts is used when the distinct drift values of all
+# questions, times this factor, are at most the number of trials: one
+# binomial draw costs about as much as this many per-trial cells
+VALUE_COUNT_FACTOR = 8
+
+# Continuous drift is grouped into this many equal-count bins per question
+VALUE_BINS = 32
+
+
+class DriftMatrix(NamedTuple):
+    question_ids: list[str]
+    drift: np.ndarray  # (n_trials, n_questions), NaN where a question is missing
+    trial_ids: np.ndarray  # (n_trials,)
+
+
+def drift_matrix(scores: Scores | list[dict], rows: np.ndarray | None = None) -> DriftMatrix:
+    """
+    Build the (n_trials x n_questions) post - baseline drift matrix.
+
+    Args:
+        scores: ResultsStore.load_scores() output, or a list of result dicts
+        rows: Boolean mask or indices selecting trials (e.g. one config_id)
+
+    Returns:
+        DriftMatrix with columns in the order of scores.question_ids
+    """
+    if isinstance(scores, list):
+        question_ids = list(dict.fromkeys(q for r in scores for q in r["baseline"]))
+        drift = np.array(
+            [[r["post"].get(q, np.nan) - r["baseline"].get(q, np.nan) for q in question_ids] for r in scores],
+            dtype=np.float64,
+        ).reshape(len(scores), len(question_ids))
+        trial_ids = np.array([r.get("trial_id", str(i)) for i, r in enumerate(scores)])
+    else:
+        question_ids = scores.question_ids
+        drift = scores.post - scores.baseline
+        trial_ids = scores.trial_ids
+    if rows is not None:
+        drift, trial_ids = drift[rows], trial_ids[rows]
+    return DriftMatrix(question_ids, drift, trial_ids)
+
+
+def weird_signs(question_ids: list[str]) -> np.ndarray:
+    """+1 for questions where higher is WEIRD, -1 otherwise (NaN for unknown questions)."""
+    higher_is_weird = {q["id"]: q["higher_is_weird"] for q in WVS_QUESTIONS}
+    return np.array([
+        np.nan if q not in higher_is_weird else (1.0 if higher_is_weird[q] else -1.0) for q in question_ids
+    ])
+
+
+def _map_chunks(fn, total: int, n_trials: int, seed: int, chunk_cells: int, workers: int | None) -> list:
+    """Run fn(rng, size) over chunks of `total` draws, each with its own spawned RNG."""
+    size = max(1, chunk_cells // max(n_trials, 1))
+    sizes = [min(size, total - start) for start in range(0, total, size)]
+    rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(len(sizes))]
+    # NumPy releases the GIL while drawing and multiplying, so threads overlap;
+    # memory is bounded by chunk_cells per worker
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        return list(executor.map(fn, rngs, sizes))
+
+
+def _value_counts(drift: np.ndarray) -> list[tuple[np.ndarray, np.ndarray, np.ndarray]] | None:
+    """
+    (values, counts, variances) of every question column, if resampling by
+    value counts is cheaper than resampling trials (else None).
+
+    Integer drift has few distinct values, each with variance 0. A column with
+    more than VALUE_BINS distinct values (continuous drift) is sorted and split
+    into VALUE_BINS equal-count bins, each given by its mean and variance.
+    """
+    columns = []
+    for column in drift.T:
+        column = column[~np.isnan(column)]
+        values, counts = np.unique(column, return_counts=True)
+        variances = np.zeros(len(values))
+        if len(values) > VALUE_BINS:
+            bins = np.array_split(np.sort(column), VALUE_BINS)
+            values = np.array([b.mean() for b in bins])
+            counts = np.array([len(b) for b in bins])
+            variances = np.array([b.var() for b in bins])
+        columns.append((values, counts, variances))
+    if sum(len(values) for values, _, _ in columns) * VALUE_COUNT_FACTOR > drift.shape[0]:
+        return None
+    return columns
+
+
+def _weighted_means(weights: np.ndarray, values: np.ndarray, present: np.ndarray) -> np.ndarray:
+    """Per-row weighted means of every column, ignoring missing (NaN) values."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (weights @ values) / (weights @ present)
+
+
+def bootstrap_means(
+    drift: np.ndarray,
+    n_resamples: int = 10_000,
+    seed: int = 0,
+    chunk_cells: int = CHUNK_CELLS,
+    workers: int | None = None,
+) -> np.ndarray:
+    """
+    Bootstrap distribution of the mean drift of every question.
+
+    Whole trials are resampled, so the resampled means of different questions
+    keep their correlation and any statistic combining questions (aggregate
+    drift, differences between questions) can be computed from the rows.
+
+    Args:
+        drift: (n_trials, n_questions) drift matrix
+        n_resamples: Number of bootstrap resamples
+        seed: Seed for the resampling RNG
+        chunk_cells: Maximum resamples x trials drawn at once
+        workers: Threads running chunks (default: one per CPU)
+
+    Returns:
+        (n_resamples, n_questions) array of resampled means
+    """
+    n_trials = drift.shape[0]
+    if n_resamples == 0 or n_trials == 0:
+        return np.full((n_resamples, drift.shape[1]), np.nan)
+
+    # float32 halves the memory traffic of the product; counts and sums stay exact enough for CIs
+    present = (~np.isnan(drift)).astype(np.float32)
+    values = np.nan_to_num(drift).astype(np.float32)
+    offsets = (np.arange(max(1, chunk_cells // max(n_trials, 1))) * n_trials).astype(np.int32)[:, None]
+
+    def resample(rng: np.random.Generator, size: int) -> np.ndarray:
+        # Resample counts per trial: one bincount over all resamples of the chunk
+        picks = rng.integers(0, n_trials, size=(size, n_trials), dtype=np.int32)
+        picks += offsets[:size]
+        counts = np.bincount(picks.ravel(), minlength=size * n_trials).reshape(size, n_trials)
+        return _weighted_means(counts.astype(np.float32), values, present).astype(np.float64)
+
+    return np.concatenate(_map_chunks(resample, n_resamples, n_trials, seed, chunk_cells, workers))
+
+
+def _marginal_bootstrap_means(
+    drift: np.ndarray,
+    n_resamples: int = 10_000,
+    seed: int = 0,
+    chunk_cells: int = CHUNK_CELLS,
+    workers: int | None = None,
+) -> np.ndarray:
+    """
+    Bootstrap distribution of every question's mean drift, for per-question CIs only.
+
+    With value counts, each question is resampled on its own (one multinomial
+    draw over its distinct values or bins), so the columns of the result are
+    independent: each one is a valid bootstrap distribution of that question's
+    mean, but no statistic combining questions may be computed from its rows.
+    Use bootstrap_means for those. For binned (continuous) drift, the sum of
+    the draws within each bin is taken as normal with the bin's mean and
+    variance, which matches the trial bootstrap in mean and variance. Falls
+    back to bootstrap_means when resampling by value counts is not cheaper.
+
+    Returns:
+        (n_resamples, n_questions) array of resampled means
+    """
+    columns = _value_counts(drift)
+    if columns is None or n_resamples == 0:
+        return bootstrap_means(drift, n_resamples, seed, chunk_cells, workers)
+
+    def resample(rng: np.random.Generator, size: int) -> np.ndarray:
+        means = np.full((size, len(columns)), np.nan)
+        for j, (values, counts, variances) in enumerate(columns):
+            n = counts.sum()
+            if n:
+                draws = rng.multinomial(n, counts / n, size=size)
+                # Spread of the draws within bins (zero for exact values)
+                spread = np.sqrt(draws @ variances) * rng.standard_normal(size)
+                means[:, j] = (draws @ values + spread) / n
+        return means
+
+    width = max(len(values) for values, _, _ in columns)
+    return np.concatenate(_map_chunks(resample, n_resamples, width, seed, chunk_cells, workers))
+
+
+def sign_flip_test(
+    drift: np.ndarray,
+    n_permutations: int = 10_000,
+    seed: int = 0,
+    chunk_cells: int = CHUNK_CELLS,
+    workers: int | None = None,
+) -> np.ndarray:
+    """
+    Paired permutation test of "no drift" for every question.
+
+    Under the null, baseline and post are exchangeable within a trial, so each
+    trial's drift is equally likely to have either sign. With value counts,
+    the number of the c trials with drift v that keep their sign is
+    Binomial(c, 1/2), so one draw per distinct value replaces c sign flips.
+    For binned (continuous) drift, the signed sum within each bin is taken as
+    normal given the number of trials keeping their sign.
+
+    Returns:
+        (n_questions,) two-sided p-values
+    """
+    n_trials = drift.shape[0]
+    present = (~np.isnan(drift)).astype(np.float64)
+    values = np.nan_to_num(drift)
+    observed = np.abs(_weighted_means(np.ones((1, n_trials)), values, present)[0])
+    denominator = present.sum(axis=0)
+
+    columns = _value_counts(drift)
+    if columns is not None:
+        def exceedances_values(rng: np.random.Generator, size: int) -> np.ndarray:
+            exceed = np.zeros(len(columns))
+            for j, (column_values, counts, variances) in enumerate(columns):
+                if not counts.sum():
+                    continue
+                kept = rng.binomial(counts, 0.5, size=(size, len(counts)))
+                # Variance of the signed sum of a bin given `kept` of its trials
+                # keep their sign (sampling without replacement)
+                spread = 4 * (kept * (counts - kept)) @ (variances / np.maximum(counts - 1, 1))
+                signed = (2 * kept - counts) @ column_values + np.sqrt(spread) * rng.standard_normal(size)
+                flipped = np.abs(signed) / denominator[j]
+                exceed[j] = (flipped >= observed[j] - 1e-12).sum()
+            return exceed
+
+        width = max(len(counts) for _, counts, _ in columns)
+        chunks = _map_chunks(exceedances_values, n_permutations, width, seed, chunk_cells, workers)
+        return (sum(chunks, np.zeros(drift.shape[1])) + 1) / (n_permutations + 1)
+
+    def exceedances(rng: np.random.Generator, size: int) -> np.ndarray:
+        signs = rng.integers(0, 2, size=(size, n_trials)) * 2.0 - 1.0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            flipped = np.abs(signs @ values) / denominator
+        # Tolerance so that ties with the observed statistic count as exceeding it
+        return (flipped >= observed - 1e-12).sum(axis=0)
+
+    chunks = _map_chunks(exceedances, n_permutations, n_trials, seed, chunk_cells, workers)
+    exceed = sum(chunks, np.zeros(drift.shape[1]))
+    return (exceed + 1) / (n_permutations + 1)
+
+
+def permutation_test(
+    drift_a: np.ndarray,
+    drift_b: np.ndarray,
+    n_permutations: int = 10_000,
+    seed: int = 0,
+    chunk_cells: int = CHUNK_CELLS,
+    workers: int | None = None,
+) -> np.ndarray:
+    """
+    Two-sample permutation test of equal mean drift between two conditions.
+
+    The two samples must be independent. Cells of one sweep (see sweep.py) are
+    not: trial j of every cell with the same bot model shares baseline j, and
+    cells differing only in n_turns share conversation j, so their drifts are
+    correlated. Compare such cells with a paired test instead: match trials
+    on result["shared"]["baseline"] and pass the row-wise difference of their
+    drifts to sign_flip_test.
+
+    Args:
+        drift_a: (n_a, n_questions) drift of condition A
+        drift_b: (n_b, n_questions) drift of condition B, same question columns
+
+    Returns:
+        (n_questions,) two-sided p-values
+    """
+    pooled = np.concatenate([drift_a, drift_b])
+    n_a, n_total = len(drift_a), len(pooled)
+    present = (~np.isnan(pooled)).astype(np.float64)
+    values = np.nan_to_num(pooled)
+    total_sum, total_count = values.sum(axis=0), present.sum(axis=0)
+
+    def difference(weights: np.ndarray) -> np.ndarray:
+        sum_a, count_a = weights @ values, weights @ present
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sum_a / count_a - (total_sum - sum_a) / (total_count - count_a)
+
+    labels = np.zeros((1, n_total))
+    labels[0, :n_a] = 1.0
+    observed = np.abs(difference(labels)[0])
+
+    def exceedances(rng: np.random.Generator, size: int) -> np.ndarray:
+        # Each row assigns a random subset of n_a trials to condition A
+        order = rng.random((size, n_total)).argsort(axis=1)
+        weights = np.zeros((size, n_total))
+        np.put_along_axis(weights, order[:, :n_a], 1.0, axis=1)
+        return (np.abs(difference(weights)) >= observed - 1e-12).sum(axis=0)
+
+    chunks = _map_chunks(exceedances, n_permutations, n_total, seed, chunk_cells, workers)
+    exceed = sum(chunks, np.zeros(pooled.shape[1]))
+    return (exceed + 1) / (n_permutations + 1)
+
+
+def drift_summary(
+    matrix: DriftMatrix,
+    n_resamples: int = 10_000,
+    confidence: float = 0.95,
+    seed: int = 0,
+    n_permutations: int | None = None,
+) -> list[dict]:
+    """
+    Per-question mean drift with percentile bootstrap CIs and sign-flip p-values.
+
+    Args:
+        matrix: Output of drift_matrix
+        n_resamples: Bootstrap resamples
+        confidence: Confidence level of the intervals
+        seed: Seed shared by the bootstrap and the permutation test
+        n_permutations: Sign flips for the p-values (default: n_resamples)
+
+    Returns:
+        One dict per question: "question", "higher_is_weird", "n", "mean_drift",
+        "ci_low", "ci_high", "weird_drift", "weird_ci_low", "weird_ci_high", "p_value".
+        weird_* are WEIRD-signed: positive means drift toward WEIRD values.
+    """
+    drift = matrix.drift
+    with np.errstate(invalid="ignore"):
+        means = np.nanmean(drift, axis=0) if len(drift) else np.full(drift.shape[1], np.nan)
+    resampled = _marginal_bootstrap_means(drift, n_resamples, seed)
+    alpha = (1 - confidence) / 2
+    low, high = np.nanquantile(resampled, [alpha, 1 - alpha], axis=0) if n_resamples else (means, means)
+    p_values = sign_flip_test(drift, n_permutations or n_resamples, seed)
+    signs = weird_signs(matrix.question_ids)
+    higher_is_weird = {q["id"]: q["higher_is_weird"] for q in WVS_QUESTIONS}
+
+    summary = []
+    for i, question in enumerate(matrix.question_ids):
+        # Flipping the sign swaps the ends of the interval
+        weird_low, weird_high = sorted((signs[i] * low[i], signs[i] * high[i]))
+        summary.append({
+            "question": question,
+            "higher_is_weird": higher_is_weird.get(question),
+            "n": int((~np.isnan(drift[:, i])).sum()),
+            "mean_drift": float(means[i]),
+            "ci_low": float(low[i]),
+            "ci_high": float(high[i]),
+            "weird_drift": float(signs[i] * means[i]),
+            "weird_ci_low": float(weird_low),
+            "weird_ci_high": float(weird_high),
+            "p_value": float(p_values[i]),
+        })
+    return summary
+
+
+def cached_drift_summary(
+    store: ResultsStore,
+    config_id: int | None = None,
+    n_resamples: int = 10_000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> list[dict]:
+    """
+    drift_summary of a results store, cached on disk by store version.
+
+    The cache lives in <store>/analysis/ and is keyed by the store version and
+    the arguments, so it is recomputed after any write to the store.
+
+    Args:
+        store: ResultsStore to summarize
+        config_id: Only use trials of this config (index into store.configs)
+    """
+    params = {
+        "version": store.version,
+        "config_id": config_id,
+        "n_resamples": n_resamples,
+        "confidence": confidence,
+        "seed": seed,
+    }
+    key = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    path = os.path.join(store.directory, "analysis", f"{key}.json")
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+
+    scores = store.load_scores()
+    rows = scores.config_ids == config_id if config_id is not None else None
+    summary = drift_summary(drift_matrix(scores, rows), n_resamples, confidence, seed)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(summary, f, indent=1)
+    os.replace(tmp_path, path)
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bootstrap drift statistics of a results store.")
+    parser.add_argument("--store", default="results_store")
+    parser.add_argument("--config-id", type=int, default=None, help="Only use trials of this config")
+    parser.add_argument("--resamples", type=int, default=10_000)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    summary = cached_drift_summary(store, args.config_id, args.resamples, args.confidence, args.seed)
+    for row in sorted(summary, key=lambda r: r["weird_drift"]):
+        print(
+            f"{row['question']:45s} n={row['n']:5d}  drift {row['mean_drift']:+.3f} "
+            f"[{row['ci_low']:+.3f}, {row['ci_high']:+.3f}]  "
+            f"WEIRD-signed {row['weird_drift']:+.3f}  p={row['p_value']:.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
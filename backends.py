@@ -0,0 +1,386 @@
+"""
+LLM backends for the experiment harness.
+
+Every function in experiment.py, runner.py, checkpoint.py and cache.py talks to
+its client only through the two chat endpoints below, so any object exposing
+them can drive an experiment:
+
+    client.chat.completions.create(model=..., messages=..., **params)
+    client.beta.chat.completions.parse(model=..., messages=..., response_format=..., **params)
+
+ChatBackend / AsyncChatBackend spell this protocol out. Implementations:
+
+    create_backend("openai", api_key=...)          - the OpenAI API
+    create_backend("local", base_url=...)          - any OpenAI-compatible server
+    create_backend("fake", seed=0, latency=0.5)    - deterministic offline FakeBackend
+
+The fake never touches the network. It simulates latency, token usage,
+429/5xx/hard failures and seeded per-question score distributions, so the
+orchestration overhead and concurrency behaviour of the runner can be measured
+at thousands of simulated trials without spending money.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Protocol
+
+import openai
+from openai import AsyncOpenAI, OpenAI
+from pydantic import BaseModel
+
+from prompts import WVS_QUESTIONS
+
+
+BACKENDS = ("openai", "local", "fake")
+
+
+class _Completions(Protocol):
+    def create(self, *, model: str, messages: list[dict], **params) -> Any: ...
+
+
+class _ParseCompletions(Protocol):
+    def parse(self, *, model: str, messages: list[dict], response_format: type[BaseModel], **params) -> Any: ...
+
+
+class _Chat(Protocol):
+    completions: _Completions
+
+
+class _BetaChat(Protocol):
+    completions: _ParseCompletions
+
+
+class _Beta(Protocol):
+    chat: _BetaChat
+
+
+class ChatBackend(Protocol):
+    """Chat completion + structured parse, as exposed by openai.OpenAI."""
+
+    chat: _Chat
+    beta: _Beta
+
+
+class AsyncChatBackend(Protocol):
+    """Same as ChatBackend, but both endpoints return awaitables (openai.AsyncOpenAI)."""
+
+    chat: _Chat
+    beta: _Beta
+
+
+def create_backend(
+    kind: str = "openai",
+    asynchronous: bool = False,
+    api_key: str | None = None,
+    base_url: str | None = None,
+    **options,
+) -> ChatBackend | AsyncChatBackend:
+    """
+    Build a backend by name.
+
+    Args:
+        kind: "openai", "local" (OpenAI-compatible server at base_url) or "fake"
+        asynchronous: Return the async variant
+        api_key: API key ("openai"; optional for "local")
+        base_url: Server URL, e.g. "http://localhost:8000/v1" ("local")
+        **options: Extra client options (OpenAI/AsyncOpenAI kwargs, or
+            FakeBackend settings for "fake")
+
+    Returns:
+        A client satisfying ChatBackend (or AsyncChatBackend)
+    """
+    if kind == "fake":
+        return AsyncFakeBackend(**options) if asynchronous else FakeBackend(**options)
+    if kind == "local":
+        if base_url is None:
+            raise ValueError('The "local" backend needs a base_url')
+        # Local servers usually ignore the key, but the client insists on one
+        api_key = api_key or "local"
+    elif kind != "openai":
+        raise ValueError(f"kind must be one of {BACKENDS}, got {kind!r}")
+    client_class = AsyncOpenAI if asynchronous else OpenAI
+    return client_class(api_key=api_key, base_url=base_url, **options)
+
+
+class InjectedRateLimitError(openai.RateLimitError):
+    """429 raised by the fake backend, carrying a Retry-After header like the real API."""
+
+    def __init__(self, retry_after: float):
+        Exception.__init__(self, "Injected rate limit (429)")
+        self.message = "Injected rate limit (429)"
+        self.status_code = 429
+        self.body = None
+        self.response = SimpleNamespace(status_code=429, headers={"retry-after": f"{retry_after:g}"})
+
+
+class InjectedServerError(openai.InternalServerError):
+    """Transient 500 raised by the fake backend."""
+
+    def __init__(self):
+        Exception.__init__(self, "Injected server error (500)")
+        self.message = "Injected server error (500)"
+        self.status_code = 500
+        self.body = None
+        self.response = SimpleNamespace(status_code=500, headers={})
+
+
+class InjectedFailure(RuntimeError):
+    """Non-retryable failure raised by the fake backend."""
+
+
+class Namespace:
+    """
+    Attribute bag for building client-shaped wrappers, e.g.
+    Namespace(chat=Namespace(completions=Namespace(create=fn))).
+    """
+
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+class _FakeModel:
+    """
+    Response generator shared by FakeBackend and AsyncFakeBackend.
+
+    Randomness is derived from the seed, the request content and how many
+    times that exact request has been seen, so a run produces the same
+    responses regardless of how concurrent calls interleave.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        latency: float = 0.0,
+        latency_sigma: float = 0.0,
+        completion_tokens: int = 150,
+        rate_limit_rate: float = 0.0,
+        server_error_rate: float = 0.0,
+        failure_rate: float = 0.0,
+        retry_after: float = 1.0,
+        score_means: dict[str, float] | None = None,
+        score_sd: float = 1.5,
+        drift_per_turn: dict[str, float] | float = 0.0,
+    ):
+        self.seed = seed
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.completion_tokens = completion_tokens
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.failure_rate = failure_rate
+        self.retry_after = retry_after
+        seeded = random.Random(seed)
+        self.score_means = {
+            q["id"]: seeded.uniform(q["scale_min"], q["scale_max"]) for q in WVS_QUESTIONS
+        }
+        self.score_means.update(score_means or {})
+        self.score_sd = score_sd
+        self.drift_per_turn = drift_per_turn
+        self.questions_by_text = {q["text"]: q for q in WVS_QUESTIONS}
+        self.questions_by_id = {q["id"]: q for q in WVS_QUESTIONS}
+        self._seen = {}
+        self._lock = threading.Lock()
+        # Observability for benchmarks
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def rng_for(self, endpoint: str, kwargs: dict) -> random.Random:
+        payload = json.dumps(
+            {"endpoint": endpoint, "model": kwargs.get("model"), "messages": kwargs.get("messages")},
+            sort_keys=True,
+        )
+        digest = hashlib.sha256(payload.encode()).hexdigest()
+        with self._lock:
+            occurrence = self._seen.get(digest, 0)
+            self._seen[digest] = occurrence + 1
+        return random.Random(f"{self.seed}:{digest}:{occurrence}")
+
+    def draw_latency(self, rng: random.Random) -> float:
+        if self.latency <= 0:
+            return 0.0
+        if self.latency_sigma <= 0:
+            return self.latency
+        # Lognormal with the requested mean
+        mu = math.log(self.latency) - self.latency_sigma**2 / 2
+        return rng.lognormvariate(mu, self.latency_sigma)
+
+    def maybe_fail(self, rng: random.Random) -> None:
+        roll = rng.random()
+        if roll < self.rate_limit_rate:
+            raise InjectedRateLimitError(self.retry_after)
+        roll -= self.rate_limit_rate
+        if roll < self.server_error_rate:
+            raise InjectedServerError()
+        roll -= self.server_error_rate
+        if roll < self.failure_rate:
+            raise InjectedFailure("Injected failure")
+
+    def start(self) -> None:
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def finish(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def mean_score(self, question: dict, messages: list[dict]) -> float:
+        # Conversation turns in context = assistant messages before the survey question
+        turns = sum(1 for m in messages if m["role"] == "assistant")
+        drift = self.drift_per_turn
+        if isinstance(drift, dict):
+            drift = drift.get(question["id"], 0.0)
+        return self.score_means[question["id"]] + drift * turns
+
+    def score(self, question: dict, messages: list[dict], rng: random.Random) -> int:
+        value = round(rng.gauss(self.mean_score(question, messages), self.score_sd))
+        return min(question["scale_max"], max(question["scale_min"], value))
+
+    def distribution(self, question: dict, messages: list[dict]) -> dict[int, float]:
+        """Discretised normal over the scale (tails folded into the end points)."""
+        mean = self.mean_score(question, messages)
+
+        def cdf(x: float) -> float:
+            return 0.5 * (1 + math.erf((x - mean) / (self.score_sd * math.sqrt(2))))
+
+        low, high = question["scale_min"], question["scale_max"]
+        return {
+            v: (1.0 if v == high else cdf(v + 0.5)) - (0.0 if v == low else cdf(v - 0.5))
+            for v in range(low, high + 1)
+        }
+
+    def respond(self, endpoint: str, kwargs: dict, rng: random.Random) -> SimpleNamespace:
+        messages = kwargs["messages"]
+        response_format = kwargs.get("response_format")
+        logprobs = None
+        parsed = None
+        completion_tokens = self.completion_tokens
+        question = self.questions_by_text.get(messages[-1]["content"])
+
+        if response_format is not None:
+            fields = {}
+            for name in response_format.model_fields:
+                if name in self.questions_by_id:
+                    fields[name] = self.score(self.questions_by_id[name], messages, rng)
+                elif name == "response":
+                    fields[name] = self.score(question, messages, rng) if question else rng.randint(1, 10)
+                else:
+                    fields[name] = None
+            parsed = response_format(**fields)
+            content = parsed.model_dump_json()
+            completion_tokens = 8 * len(fields)
+        elif kwargs.get("logprobs") and question is not None:
+            distribution = self.distribution(question, messages)
+            top = [(v, p) for v, p in sorted(distribution.items(), key=lambda item: -item[1]) if p > 0]
+            top = top[: kwargs.get("top_logprobs", 20)]
+            content = str(top[0][0])
+            alternatives = [SimpleNamespace(token=str(v), logprob=math.log(p)) for v, p in top]
+            logprobs = SimpleNamespace(content=[
+                SimpleNamespace(token=content, logprob=alternatives[0].logprob, top_logprobs=alternatives)
+            ])
+            completion_tokens = 1
+        else:
+            content = f"Simulated reply {rng.getrandbits(32):08x} after {len(messages)} messages."
+
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4 + 4 * len(messages)
+        return SimpleNamespace(
+            id=f"chatcmpl-fake-{rng.getrandbits(48):012x}",
+            model=kwargs.get("model"),
+            choices=[SimpleNamespace(
+                index=0,
+                finish_reason="stop",
+                logprobs=logprobs,
+                message=SimpleNamespace(role="assistant", content=content, parsed=parsed, refusal=None),
+            )],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+                prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+            ),
+        )
+
+
+class _FakeStats:
+    """Load counters of a fake backend, for benchmarks."""
+
+    _model: _FakeModel
+
+    @property
+    def calls(self) -> int:
+        return self._model.calls
+
+    @property
+    def in_flight(self) -> int:
+        return self._model.in_flight
+
+    @property
+    def max_in_flight(self) -> int:
+        return self._model.max_in_flight
+
+
+class FakeBackend(_FakeStats):
+    """
+    Deterministic offline stand-in for openai.OpenAI.
+
+    Args:
+        seed: Seed for every random draw
+        latency: Mean simulated latency per call in seconds
+        latency_sigma: Lognormal sigma of the latency (0 for constant latency)
+        completion_tokens: Completion tokens reported for free-text replies
+        rate_limit_rate: Probability that a call raises a 429 (retryable)
+        server_error_rate: Probability that a call raises a 500 (retryable)
+        failure_rate: Probability that a call raises InjectedFailure
+        retry_after: Retry-After seconds sent with injected 429s
+        score_means: Mean score per question id (default: seeded uniform over the scale)
+        score_sd: Standard deviation of sampled scores
+        drift_per_turn: Shift of the mean score per conversation turn in context,
+            either one value or a dict per question id
+
+    Attributes calls, in_flight and max_in_flight report load for benchmarks.
+    """
+
+    def __init__(self, **options):
+        self._model = _FakeModel(**options)
+
+        def call(endpoint: str, kwargs: dict):
+            rng = self._model.rng_for(endpoint, kwargs)
+            self._model.start()
+            try:
+                time.sleep(self._model.draw_latency(rng))
+                self._model.maybe_fail(rng)
+                return self._model.respond(endpoint, kwargs, rng)
+            finally:
+                self._model.finish()
+
+        self.chat = Namespace(completions=Namespace(create=lambda **kw: call("create", kw)))
+        self.beta = Namespace(chat=Namespace(completions=Namespace(parse=lambda **kw: call("parse", kw))))
+
+
+class AsyncFakeBackend(_FakeStats):
+    """Async counterpart of FakeBackend (stand-in for openai.AsyncOpenAI); same options."""
+
+    def __init__(self, **options):
+        self._model = _FakeModel(**options)
+
+        async def call(endpoint: str, kwargs: dict):
+            rng = self._model.rng_for(endpoint, kwargs)
+            self._model.start()
+            try:
+                await asyncio.sleep(self._model.draw_latency(rng))
+                self._model.maybe_fail(rng)
+                return self._model.respond(endpoint, kwargs, rng)
+            finally:
+                self._model.finish()
+
+        self.chat = Namespace(completions=Namespace(create=lambda **kw: call("create", kw)))
+        self.beta = Namespace(chat=Namespace(completions=Namespace(parse=lambda **kw: call("parse", kw))))
+
@@ -0,0 +1,460 @@
+"""
+OpenAI Batch API execution mode for large sweeps.
+
+Batch jobs cost half as much as interactive calls and have their own rate
+limits, at the price of latency. A conversation is turn-sequential, but turn k
+of every trial can go into the same job, so this driver advances all trials in
+lock-step, one batch job per step:
+
+    1. every baseline survey question + every conversation opener
+    2. bot reply for turn 1 of every trial
+    3. user reply for turn 1 of every trial
+    ...
+    last. every post-survey question
+
+Each step writes JSONL input files, uploads them, polls the jobs until they
+finish and merges the outputs back into per-trial state. A step larger than
+the API's per-job request limit is split over several jobs. Results use the
+same schema as experiment.run_experiment. A trial whose request errors, or is
+missing from the output of a failed or expired job, is dropped from later
+steps and reported as a failure; the other trials carry on.
+
+FakeBatchClient is an in-process stand-in for the files/batches endpoints, so
+the whole pipeline runs offline:
+
+    outcome = run_trials_batch(FakeBatchClient(seed=0), n=10, n_turns=3, poll_interval=0)
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+from types import SimpleNamespace
+
+from openai import OpenAI
+from pydantic import BaseModel
+
+from cache import to_namespace
+from context import ContextCompactor, context_policy as make_context_policy
+from experiment import (
+    batched_scores,
+    batched_survey_request,
+    experiment_result,
+    flip_roles,
+    opener_messages,
+    survey_messages,
+)
+from prompts import BOT_SYSTEM_PROMPT, USER_SYSTEM_PROMPT, WVS_QUESTIONS, BatchedSurveyResponse, SurveyResponse
+from runner import save_result
+from telemetry import Telemetry
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Most requests the Batch API accepts in one job
+MAX_BATCH_REQUESTS = 50_000
+# Survey modes that need only one round-trip per step ("logprobs" may need a fallback call)
+BATCH_SURVEY_MODES = ("per_question", "batched")
+# Context policies that need no extra calls ("summary" would add a step per summary update)
+BATCH_CONTEXT_POLICIES = ("full", "window", "pinned")
+
+
+def _strict_schema(schema: dict) -> dict:
+    """Make a Pydantic JSON schema acceptable to strict structured outputs."""
+    if isinstance(schema, dict):
+        schema = {k: _strict_schema(v) for k, v in schema.items() if k not in ("default", "title")}
+        if schema.get("type") == "object":
+            schema["additionalProperties"] = False
+            schema["required"] = list(schema.get("properties", {}))
+        return schema
+    if isinstance(schema, list):
+        return [_strict_schema(v) for v in schema]
+    return schema
+
+
+def response_format_param(model: type[BaseModel]) -> dict:
+    """Raw `response_format` for a Pydantic model, as the Batch API expects it."""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": model.__name__, "schema": _strict_schema(model.model_json_schema()), "strict": True},
+    }
+
+
+def _parsed_response(body: dict, response_format: type[BaseModel]) -> SimpleNamespace:
+    """Rebuild a parse()-style response (with message.parsed) from a batch output body."""
+    response = to_namespace(body)
+    message = response.choices[0].message
+    message.parsed = response_format.model_validate_json(message.content)
+    return response
+
+
+def _submit_job(client: OpenAI, requests: dict[str, dict], workdir: str, name: str):
+    input_path = os.path.join(workdir, f"{name}.input.jsonl")
+    with open(input_path, "w") as f:
+        for custom_id, body in requests.items():
+            f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}) + "\n")
+
+    with open(input_path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    job = client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h")
+    print(f"Batch {name}: {len(requests)} requests submitted as {job.id}")
+    return job
+
+
+def _job_outputs(client: OpenAI, job, requests: dict[str, dict], workdir: str, name: str) -> dict[str, dict | str]:
+    """Outputs of a finished job; requests it did not finish map to an error message."""
+    if job.status == "completed":
+        missing = "missing from batch output"
+    else:
+        # Failed, expired and cancelled jobs may still have outputs for the requests they finished
+        missing = f"batch job {job.id} {job.status}"
+        print(f"Batch {name} ({job.id}) ended with status {job.status}")
+    outputs = {custom_id: missing for custom_id in requests}
+    for file_id in (getattr(job, "output_file_id", None), getattr(job, "error_file_id", None)):
+        if not file_id:
+            continue
+        text = client.files.content(file_id).text
+        with open(os.path.join(workdir, f"{name}.{'output' if file_id == job.output_file_id else 'errors'}.jsonl"), "w") as f:
+            f.write(text)
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                outputs[record["custom_id"]] = str(record.get("error") or response.get("body"))
+            else:
+                outputs[record["custom_id"]] = response["body"]
+    return outputs
+
+
+def run_batch(
+    client: OpenAI,
+    requests: dict[str, dict],
+    workdir: str,
+    name: str,
+    poll_interval: float = 30.0,
+    max_requests: int = MAX_BATCH_REQUESTS,
+) -> dict[str, dict | str]:
+    """
+    Run one step as batch jobs of at most `max_requests` requests and wait for all of them.
+
+    Args:
+        client: OpenAI client (or FakeBatchClient)
+        requests: Mapping of custom_id to chat completion request body
+        workdir: Directory for the JSONL input/output files
+        name: Step name used in the file names
+        poll_interval: Seconds between status checks
+        max_requests: Requests per job
+
+    Returns:
+        Mapping of custom_id to the response body, or to an error message
+        for requests that failed (including those a failed or expired job
+        did not finish)
+    """
+    os.makedirs(workdir, exist_ok=True)
+    custom_ids = list(requests)
+    parts = [custom_ids[i:i + max_requests] for i in range(0, len(custom_ids), max_requests)]
+    jobs = []
+    for k, part in enumerate(parts):
+        part_name = name if len(parts) == 1 else f"{name}.part{k:02d}"
+        part_requests = {custom_id: requests[custom_id] for custom_id in part}
+        jobs.append((part_name, part_requests, _submit_job(client, part_requests, workdir, part_name)))
+
+    outputs = {}
+    for part_name, part_requests, job in jobs:
+        while job.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(poll_interval)
+            job = client.batches.retrieve(job.id)
+        outputs.update(_job_outputs(client, job, part_requests, workdir, part_name))
+    return outputs
+
+
+def run_trials_batch(
+    client: OpenAI,
+    n: int,
+    bot_model: str = "gpt-4o",
+    user_model: str = "gpt-4o",
+    n_turns: int = 10,
+    survey_mode: str = "per_question",
+    workdir: str = "batches",
+    results_dir: str | None = "results",
+    poll_interval: float = 30.0,
+    context_policy: dict | None = None,
+    max_requests: int = MAX_BATCH_REQUESTS,
+) -> dict:
+    """
+    Run `n` trials through the Batch API, all trials advancing in lock-step.
+
+    Args:
+        client: OpenAI client (or FakeBatchClient)
+        n: Number of trials
+        bot_model: Model for the bot LLM (the one we measure for drift)
+        user_model: Model for the user LLM (prompted with non-WEIRD values)
+        n_turns: Number of conversation turns per trial
+        survey_mode: "per_question" or "batched" (see experiment.measure_wvs)
+        workdir: Directory for the batch JSONL files of this run
+        results_dir: Directory to save each finished trial to (None to skip saving)
+        poll_interval: Seconds between batch status checks
+        context_policy: "window" or "pinned" policy from context.context_policy
+            (None sends the full history)
+        max_requests: Requests per batch job; larger steps are split
+
+    Returns:
+        Dict with "results" and "failures", as runner.run_trials
+    """
+    if survey_mode not in BATCH_SURVEY_MODES:
+        raise ValueError(f"survey_mode must be one of {BATCH_SURVEY_MODES} in batch mode, got {survey_mode!r}")
+    if context_policy is not None and context_policy["kind"] not in BATCH_CONTEXT_POLICIES:
+        raise ValueError(f"context policy must be one of {BATCH_CONTEXT_POLICIES} in batch mode")
+    context = ContextCompactor(context_policy)
+    run_dir = os.path.join(workdir, f"run_{int(time.time() * 1000)}")
+    trials = {i: {"baseline": {}, "post": {}, "conversation": [], "telemetry": Telemetry()} for i in range(n)}
+    failures = []
+
+    def fail(index: int, error: str) -> None:
+        if index in trials:
+            print(f"Trial {index} failed: {error}")
+            failures.append({"trial": index, "error": error})
+            del trials[index]
+
+    def survey_requests(index: int, stage: str, history: list[dict]) -> dict[str, dict]:
+        if survey_mode == "batched":
+            request = batched_survey_request(WVS_QUESTIONS, history)
+            body = {"model": bot_model, "messages": request["messages"],
+                    "response_format": response_format_param(request["response_format"])}
+            return {f"{index}:{stage}:all": body}
+        return {
+            f"{index}:{stage}:{question['id']}": {
+                "model": bot_model,
+                "messages": survey_messages(question, history),
+                "response_format": response_format_param(SurveyResponse),
+            }
+            for question in WVS_QUESTIONS
+        }
+
+    def merge_surveys(outputs: dict, stage: str) -> None:
+        for custom_id, body in outputs.items():
+            parts = custom_id.split(":")
+            if len(parts) != 3 or parts[1] != stage or int(parts[0]) not in trials:
+                continue
+            index, key = int(parts[0]), parts[2]
+            if isinstance(body, str):
+                fail(index, f"{stage} survey: {body}")
+                continue
+            # Batch jobs have no per-request latency
+            trials[index]["telemetry"].record(f"{stage}_survey", body["model"], body.get("usage"), None, batch=True)
+            if key == "all":
+                trials[index][stage] = batched_scores(_parsed_response(body, BatchedSurveyResponse), WVS_QUESTIONS)
+            else:
+                trials[index][stage][key] = float(_parsed_response(body, SurveyResponse).choices[0].message.parsed.response)
+
+    def merge_messages(outputs: dict, role: str, stage: str) -> None:
+        for custom_id, body in outputs.items():
+            index = int(custom_id.split(":", 1)[0])
+            if index not in trials:
+                continue
+            if isinstance(body, str):
+                fail(index, f"{role} message {len(trials[index]['conversation'])}: {body}")
+            else:
+                trials[index]["telemetry"].record(stage, body["model"], body.get("usage"), None, batch=True)
+                trials[index]["conversation"].append({"role": role, "content": body["choices"][0]["message"]["content"]})
+
+    # 1. Baselines and openers (independent of each other) in one job
+    requests = {}
+    for index in trials:
+        requests.update(survey_requests(index, "baseline", []))
+        requests[f"{index}:opener"] = {"model": user_model, "messages": opener_messages()}
+    outputs = run_batch(client, requests, run_dir, "step_00_baseline_opener", poll_interval, max_requests)
+    merge_surveys(outputs, "baseline")
+    merge_messages({k: v for k, v in outputs.items() if k.endswith(":opener")}, "user", "opener")
+
+    # 2. Conversation turns: bot replies for every trial, then user replies
+    for turn in range(1, n_turns + 1):
+        requests = {
+            f"{index}:bot{turn}": {
+                "model": bot_model,
+                "messages": [{"role": "system", "content": BOT_SYSTEM_PROMPT}] + context.view(trial["conversation"]),
+            }
+            for index, trial in trials.items()
+        }
+        outputs = run_batch(client, requests, run_dir, f"step_{2 * turn - 1:02d}_bot", poll_interval, max_requests)
+        merge_messages(outputs, "assistant", "bot_turn")
+
+        requests = {
+            f"{index}:user{turn}": {
+                "model": user_model,
+                "messages": [{"role": "system", "content": USER_SYSTEM_PROMPT}]
+                + flip_roles(context.view(trial["conversation"], role="user")),
+            }
+            for index, trial in trials.items()
+        }
+        outputs = run_batch(client, requests, run_dir, f"step_{2 * turn:02d}_user", poll_interval, max_requests)
+        merge_messages(outputs, "user", "user_turn")
+
+    # 3. Post surveys with the full conversation in context
+    requests = {}
+    for index, trial in trials.items():
+        requests.update(survey_requests(index, "post", context.view(trial["conversation"])))
+    outputs = run_batch(client, requests, run_dir, f"step_{2 * n_turns + 1:02d}_post", poll_interval, max_requests)
+    merge_surveys(outputs, "post")
+
+    results = []
+    for index, trial in trials.items():
+        result = experiment_result(
+            trial["baseline"], trial["post"], trial["conversation"], {}, None, trial["telemetry"],
+            bot_model=bot_model, user_model=user_model, n_turns=n_turns,
+            survey_mode=survey_mode, measure_every=None, context_policy=context_policy, execution="batch",
+        )
+        if results_dir is not None:
+            save_result(result, results_dir)
+        results.append(result)
+    print(f"{len(results)} trials finished, {len(failures)} failed")
+    return {"results": results, "failures": failures}
+
+
+class FakeBatchClient:
+    """
+    In-process stand-in for the OpenAI files and batches endpoints.
+
+    Jobs complete after `polls_until_done` status checks. Each request is
+    answered by `responder(body) -> chat completion dict`; the default
+    responder returns canned text replies and random in-range structured
+    survey answers drawn from a seeded RNG. Requests whose custom_id is in
+    `fail_ids` get an error result instead. A job holding any custom_id in
+    `expire_ids` ends "expired", with outputs for all its other requests. A
+    job with more than `max_requests` requests ends "failed" without outputs,
+    as the real endpoint rejects it.
+    """
+
+    def __init__(
+        self,
+        responder=None,
+        polls_until_done: int = 1,
+        seed: int | None = None,
+        fail_ids=(),
+        expire_ids=(),
+        max_requests: int = MAX_BATCH_REQUESTS,
+    ):
+        self.rng = random.Random(seed)
+        self.responder = responder or self._default_response
+        self.polls_until_done = polls_until_done
+        self.fail_ids = set(fail_ids)
+        self.expire_ids = set(expire_ids)
+        self.max_requests = max_requests
+        self._files = {}
+        self._jobs = {}
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch)
+
+    def _create_file(self, file, purpose: str) -> SimpleNamespace:
+        file_id = f"file-{len(self._files)}"
+        content = file.read() if hasattr(file, "read") else file
+        self._files[file_id] = content.decode() if isinstance(content, bytes) else content
+        return SimpleNamespace(id=file_id, purpose=purpose)
+
+    def _file_content(self, file_id: str) -> SimpleNamespace:
+        return SimpleNamespace(text=self._files[file_id])
+
+    def _create_batch(self, input_file_id: str, endpoint: str, completion_window: str) -> SimpleNamespace:
+        job = SimpleNamespace(
+            id=f"batch-{len(self._jobs)}", status="validating", input_file_id=input_file_id,
+            output_file_id=None, error_file_id=None, polls=0,
+        )
+        self._jobs[job.id] = job
+        return job
+
+    def _retrieve_batch(self, batch_id: str) -> SimpleNamespace:
+        job = self._jobs[batch_id]
+        job.polls += 1
+        if job.status in ("validating", "in_progress"):
+            if job.polls >= self.polls_until_done:
+                self._complete(job)
+            else:
+                job.status = "in_progress"
+        return job
+
+    def _complete(self, job: SimpleNamespace) -> None:
+        lines = self._files[job.input_file_id].splitlines()
+        if len(lines) > self.max_requests:
+            job.status = "failed"
+            return
+        outputs, errors = [], []
+        status = "completed"
+        for line in lines:
+            request = json.loads(line)
+            if request["custom_id"] in self.expire_ids:
+                status = "expired"
+                continue
+            if request["custom_id"] in self.fail_ids:
+                errors.append({"custom_id": request["custom_id"], "response": None,
+                               "error": {"code": "server_error", "message": "injected failure"}})
+                continue
+            outputs.append({"custom_id": request["custom_id"], "error": None,
+                            "response": {"status_code": 200, "body": self.responder(request["body"])}})
+        job.output_file_id = self._create_file("\n".join(json.dumps(o) for o in outputs), "batch_output").id
+        if errors:
+            job.error_file_id = self._create_file("\n".join(json.dumps(e) for e in errors), "batch_output").id
+        job.status = status
+
+    def _default_response(self, body: dict) -> dict:
+        response_format = body.get("response_format")
+        if response_format is not None:
+            properties = response_format["json_schema"]["schema"]["properties"]
+            content = json.dumps({
+                name: self.rng.randint(spec.get("minimum", 1), spec.get("maximum", 10))
+                if spec.get("type") == "integer" else None
+                for name, spec in properties.items()
+            })
+        else:
+            content = f"Canned reply #{self.rng.randint(0, 10**6)} to {len(body['messages'])} messages."
+        return {
+            "id": f"chatcmpl-fake-{self.rng.randint(0, 10**9)}",
+            "object": "chat.completion",
+            "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run WEIRD bias drift trials through the OpenAI Batch API.")
+    parser.add_argument("--trials", type=int, default=100)
+    parser.add_argument("--bot-model", default="gpt-4o")
+    parser.add_argument("--user-model", default="gpt-4o")
+    parser.add_argument("--n-turns", type=int, default=10)
+    parser.add_argument("--survey-mode", default="per_question", choices=BATCH_SURVEY_MODES)
+    parser.add_argument("--context-policy", default="full", choices=BATCH_CONTEXT_POLICIES)
+    parser.add_argument("--context-max-tokens", type=int, default=None, help="Token budget for --context-policy window")
+    parser.add_argument("--context-recent", type=int, default=None, help="Recent messages kept for --context-policy pinned")
+    parser.add_argument("--workdir", default="batches")
+    parser.add_argument("--results-dir", default="results")
+    parser.add_argument("--poll-interval", type=float, default=30.0)
+    parser.add_argument("--fake", action="store_true", help="Use the offline FakeBatchClient")
+    args = parser.parse_args()
+
+    if args.fake:
+        client = FakeBatchClient(seed=0)
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+        client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+
+    run_trials_batch(
+        client,
+        args.trials,
+        bot_model=args.bot_model,
+        user_model=args.user_model,
+        n_turns=args.n_turns,
+        survey_mode=args.survey_mode,
+        workdir=args.workdir,
+        results_dir=args.results_dir,
+        poll_interval=args.poll_interval,
+        context_policy=make_context_policy(
+            args.context_policy, max_tokens=args.context_max_tokens, recent_messages=args.context_recent
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
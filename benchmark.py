@@ -0,0 +1,434 @@
+"""
+Throughput and memory benchmarks for the experiment harness.
+
+Everything runs against the in-process fake backend (see backends.py), whose
+call latencies are lognormal with a configurable mean and sigma, so the
+numbers measure the harness itself rather than a provider. Three groups of
+benchmarks are run:
+
+    "components"  one measure_wvs, run_conversation and run_experiment call
+                  on the synchronous fake backend: wall time and calls made
+    "trials"      for each N: runner.run_trials of N trials on the async fake
+                  backend, with every result (and its full conversation)
+                  retained: trials/minute, requests/second and requests in
+                  flight (mean and max), then peak traced memory from a
+                  second run of the same trials under tracemalloc, which
+                  would otherwise slow the throughput run about 3x
+    "analysis"    for each N: writing N result JSON files, loading them the
+                  old way (json.load per file), migrating them into a
+                  ResultsStore, loading the store's scores, and bootstrapping
+                  the drift summary
+
+The components and analysis measurements are repeated (--repeats, default 3)
+and the median kept; the trials runs are long enough to be measured once. The
+results are written as JSON together with the git commit, so a run on one
+commit can be compared with a run on another. --compare ignores changes within
+--tolerance (relative) or within a per-metric absolute noise floor:
+
+    python benchmark.py --output bench_main.json
+    python benchmark.py --output bench_branch.json --compare bench_main.json
+
+Usage from the command line:
+    python benchmark.py                                 # full run, N = 100, 1k, 10k (~30 minutes)
+    python benchmark.py --latency 0.05 --sizes 100,1000   # quick check
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from analysis import cached_drift_summary, drift_matrix, drift_summary
+from backends import create_backend
+from experiment import measure_wvs, run_conversation, run_experiment
+from prompts import WVS_QUESTIONS
+from runner import run_trials, save_result
+from store import ResultsStore, migrate_json_results
+
+
+# Sampling period of the requests-in-flight gauge during run_trials
+IN_FLIGHT_SAMPLE_S = 0.01
+
+# Metrics where a larger value is an improvement (everything else is a cost)
+HIGHER_IS_BETTER = ("trials_per_minute", "requests_per_s", "mean_in_flight", "max_in_flight")
+
+# Absolute changes --compare treats as noise whatever their relative size,
+# by metric name suffix (e.g. a millisecond load time moving by 1 ms)
+NOISE_FLOORS = {"_s": 0.01, "_mb": 0.5, "_kb_per_trial": 0.5, "_in_flight": 1.0}
+
+
+def _fake_options(latency: float, latency_sigma: float, seed: int) -> dict:
+    return {"seed": seed, "latency": latency, "latency_sigma": latency_sigma}
+
+
+def _environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _median_row(rows: list[dict]) -> dict:
+    """Metric-wise median of repeated measurements."""
+    return {key: float(np.median([row[key] for row in rows])) for key in rows[0]}
+
+
+def bench_components(
+    n_turns: int = 3,
+    latency: float = 0.5,
+    latency_sigma: float = 0.6,
+    seed: int = 0,
+    survey_mode: str = "per_question",
+    repeats: int = 3,
+) -> dict:
+    """
+    Time one call of each synchronous experiment function (median of `repeats` calls).
+
+    Returns:
+        {"measure_wvs" | "run_conversation" | "run_experiment": {"wall_s", "calls"}}
+    """
+    timings = {}
+
+    def timed(name, fn):
+        rows = []
+        for _ in range(repeats):
+            client = create_backend("fake", **_fake_options(latency, latency_sigma, seed))
+            start = time.perf_counter()
+            # measure_wvs prints every score
+            with contextlib.redirect_stdout(io.StringIO()):
+                fn(client)
+            rows.append({"wall_s": time.perf_counter() - start, "calls": client.calls})
+        timings[name] = _median_row(rows)
+
+    timed("measure_wvs", lambda client: measure_wvs(client, "gpt-4o", [], survey_mode=survey_mode))
+    timed("run_conversation", lambda client: run_conversation(client, "gpt-4o", "gpt-4o", n_turns))
+    timed("run_experiment", lambda client: run_experiment(
+        client=client, n_turns=n_turns, survey_mode=survey_mode
+    ))
+    return timings
+
+
+def _run_trials(
+    n_trials: int,
+    concurrency: int,
+    n_turns: int,
+    fake_options: dict,
+    survey_mode: str,
+) -> tuple[dict, float, object, list[int]]:
+    """One run_trials run on a fresh fake backend: (outcome, wall_s, client, in-flight samples)."""
+    client = create_backend("fake", asynchronous=True, **fake_options)
+    samples = []
+
+    async def sample_in_flight(done: asyncio.Event) -> None:
+        while not done.is_set():
+            samples.append(client.in_flight)
+            await asyncio.sleep(IN_FLIGHT_SAMPLE_S)
+
+    async def run() -> dict:
+        done = asyncio.Event()
+        sampler = asyncio.create_task(sample_in_flight(done))
+        try:
+            return await run_trials(
+                n_trials,
+                concurrency=concurrency,
+                n_turns=n_turns,
+                client=client,
+                results_dir=None,
+                survey_mode=survey_mode,
+            )
+        finally:
+            done.set()
+            await sampler
+
+    start = time.perf_counter()
+    # run_trials prints a line per finished trial
+    with contextlib.redirect_stdout(io.StringIO()):
+        outcome = asyncio.run(run())
+    return outcome, time.perf_counter() - start, client, samples
+
+
+def bench_trials(
+    n_trials: int = 100,
+    concurrency: int = 200,
+    n_turns: int = 10,
+    latency: float = 0.5,
+    latency_sigma: float = 0.6,
+    seed: int = 0,
+    survey_mode: str = "per_question",
+) -> dict:
+    """
+    Run n_trials with runner.run_trials and measure throughput and memory.
+
+    Throughput is measured on an untraced run. The same trials are then run
+    again under tracemalloc for the memory figures. Every result is kept in
+    memory until the end, as run_trials does, so peak_memory_mb includes all
+    full conversation histories.
+
+    Returns:
+        Dict with "trials", "failures", "wall_s", "trials_per_minute", "calls",
+        "requests_per_s", "mean_in_flight", "max_in_flight", "peak_memory_mb"
+        and "retained_kb_per_trial"
+    """
+    options = _fake_options(latency, latency_sigma, seed)
+    outcome, wall, client, samples = _run_trials(n_trials, concurrency, n_turns, options, survey_mode)
+    finished = len(outcome["results"])
+    row = {
+        "trials": finished,
+        "failures": len(outcome["failures"]),
+        "wall_s": wall,
+        "trials_per_minute": finished / wall * 60,
+        "calls": client.calls,
+        "requests_per_s": client.calls / wall,
+        "mean_in_flight": float(np.mean(samples)) if samples else 0.0,
+        "max_in_flight": client.max_in_flight,
+    }
+    del outcome
+
+    tracemalloc.start()
+    try:
+        traced, _, _, _ = _run_trials(n_trials, concurrency, n_turns, options, survey_mode)
+        retained, peak = tracemalloc.get_traced_memory()
+        traced_finished = len(traced["results"])
+        del traced
+    finally:
+        tracemalloc.stop()
+    return {
+        **row,
+        "peak_memory_mb": peak / 2**20,
+        "retained_kb_per_trial": retained / max(traced_finished, 1) / 2**10,
+    }
+
+
+def synthetic_results(n: int, template: dict, seed: int = 0) -> list[dict]:
+    """
+    n results shaped like `template` (conversation, config and telemetry) with fresh scores.
+
+    Each conversation gets the trial index appended to every message, so no
+    two trials share a conversation blob in the store.
+    """
+    rng = np.random.default_rng(seed)
+    low = np.array([q["scale_min"] for q in WVS_QUESTIONS])
+    high = np.array([q["scale_max"] for q in WVS_QUESTIONS])
+    means = rng.uniform(low, high)
+    baselines = np.clip(np.rint(rng.normal(means, 1.5, (n, len(means)))), low, high)
+    posts = np.clip(np.rint(rng.normal(means + rng.normal(0, 0.5, len(means)), 1.5, (n, len(means)))), low, high)
+    ids = [q["id"] for q in WVS_QUESTIONS]
+    results = []
+    for i in range(n):
+        results.append({
+            **template,
+            "baseline": dict(zip(ids, baselines[i].tolist())),
+            "post": dict(zip(ids, posts[i].tolist())),
+            "conversation": [{**m, "content": f"{m['content']} [{i}]"} for m in template["conversation"]],
+        })
+    return results
+
+
+def bench_analysis(
+    sizes: list[int],
+    n_turns: int = 10,
+    n_resamples: int = 10_000,
+    seed: int = 0,
+    workdir: str | None = None,
+    repeats: int = 3,
+) -> dict:
+    """
+    Time the load and bootstrap path at each number of results (median of `repeats` runs).
+
+    Returns:
+        {str(N): {"write_json_s", "json_mb", "load_json_s", "migrate_s",
+        "store_mb", "load_store_s", "bootstrap_s", "cached_summary_s"}}
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        template = run_experiment(client=create_backend("fake", seed=seed), n_turns=n_turns)
+    return {
+        str(n): _median_row([_analysis_row(n, template, n_resamples, seed, workdir) for _ in range(repeats)])
+        for n in sizes
+    }
+
+
+def _analysis_row(n: int, template: dict, n_resamples: int, seed: int, workdir: str | None) -> dict:
+    """One measurement of every bench_analysis metric at n results."""
+    results = synthetic_results(n, template, seed)
+    root = tempfile.mkdtemp(prefix=f"bench_{n}_", dir=workdir)
+    try:
+        results_dir = os.path.join(root, "results")
+        store_dir = os.path.join(root, "store")
+        row = {}
+
+        start = time.perf_counter()
+        for result in results:
+            save_result(result, results_dir)
+        row["write_json_s"] = time.perf_counter() - start
+        row["json_mb"] = _directory_size(results_dir) / 2**20
+        del results
+
+        start = time.perf_counter()
+        loaded = []
+        for filename in sorted(os.listdir(results_dir)):
+            with open(os.path.join(results_dir, filename)) as f:
+                loaded.append(json.load(f))
+        drift_matrix(loaded)
+        row["load_json_s"] = time.perf_counter() - start
+        del loaded
+
+        start = time.perf_counter()
+        migrate_json_results(results_dir, ResultsStore(store_dir))
+        row["migrate_s"] = time.perf_counter() - start
+        row["store_mb"] = _directory_size(store_dir) / 2**20
+
+        start = time.perf_counter()
+        matrix = drift_matrix(ResultsStore(store_dir).load_scores())
+        row["load_store_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        drift_summary(matrix, n_resamples, seed=seed)
+        row["bootstrap_s"] = time.perf_counter() - start
+
+        store = ResultsStore(store_dir)
+        cached_drift_summary(store, n_resamples=n_resamples, seed=seed)
+        start = time.perf_counter()
+        cached_drift_summary(store, n_resamples=n_resamples, seed=seed)
+        row["cached_summary_s"] = time.perf_counter() - start
+        return row
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _directory_size(directory: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names
+    )
+
+
+def _flatten(data: dict, prefix: str = "") -> dict[str, float]:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(current: dict, previous: dict, tolerance: float = 0.05) -> list[dict]:
+    """
+    Metric-by-metric comparison of two benchmark reports.
+
+    Args:
+        current: The new report
+        previous: The report to compare against
+        tolerance: Relative change treated as noise. Changes within the
+            metric's NOISE_FLOORS entry are noise too, however large relative
+            to the previous value.
+
+    Returns:
+        One dict per metric present in both: "metric", "previous", "current",
+        "ratio" (current / previous) and "better" (True, False, or None if
+        within tolerance)
+    """
+    before = _flatten({k: previous[k] for k in ("components", "trials", "analysis") if k in previous})
+    after = _flatten({k: current[k] for k in ("components", "trials", "analysis") if k in current})
+    rows = []
+    for metric in sorted(set(before) & set(after)):
+        old, new = before[metric], after[metric]
+        ratio = new / old if old else None
+        floor = next((v for suffix, v in NOISE_FLOORS.items() if metric.endswith(suffix)), 0.0)
+        better = None
+        if abs(new - old) > max(tolerance * abs(old), floor):
+            better = (new > old) == metric.endswith(HIGHER_IS_BETTER)
+        rows.append({"metric": metric, "previous": old, "current": new, "ratio": ratio, "better": better})
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the experiment harness against the fake backend.")
+    parser.add_argument("--output", default=None, help="JSON report path (default: benchmark_<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="Relative change --compare treats as noise")
+    parser.add_argument("--only", default="components,trials,analysis",
+                        help="Comma-separated benchmark groups to run")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean fake call latency in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.6, help="Lognormal sigma of the fake latency")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--survey-mode", default="per_question")
+    parser.add_argument("--component-turns", type=int, default=3, help="n_turns of the components benchmark")
+    parser.add_argument("--sizes", default="100,1000,10000",
+                        help="Comma-separated N for the trials and analysis benchmarks")
+    parser.add_argument("--concurrency", type=int, default=200, help="Trials in flight in the trials benchmark")
+    parser.add_argument("--n-turns", type=int, default=10, help="n_turns of the trials and analysis benchmarks")
+    parser.add_argument("--resamples", type=int, default=10_000, help="Bootstrap resamples")
+    parser.add_argument("--workdir", default=None, help="Scratch directory for the analysis benchmark")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per components and analysis measurement; the median is reported")
+    args = parser.parse_args()
+
+    groups = args.only.split(",")
+    sizes = [int(n) for n in args.sizes.split(",")]
+    report = {"environment": _environment(), "parameters": vars(args)}
+    if "components" in groups:
+        print("Running components benchmark...", file=sys.stderr)
+        report["components"] = bench_components(
+            args.component_turns, args.latency, args.latency_sigma, args.seed, args.survey_mode, args.repeats
+        )
+    if "trials" in groups:
+        report["trials"] = {}
+        for n in sizes:
+            print(f"Running trials benchmark at N={n}...", file=sys.stderr)
+            report["trials"][str(n)] = bench_trials(
+                n, args.concurrency, args.n_turns, args.latency, args.latency_sigma, args.seed, args.survey_mode,
+            )
+    if "analysis" in groups:
+        print("Running analysis benchmark...", file=sys.stderr)
+        report["analysis"] = bench_analysis(
+            sizes, args.n_turns, args.resamples, args.seed, args.workdir, args.repeats
+        )
+
+    output = args.output or f"benchmark_{(report['environment']['commit'] or 'unknown')[:10]}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for metric, value in _flatten({k: v for k, v in report.items() if k not in ("environment", "parameters")}).items():
+        print(f"{metric:45s} {value:12.3f}")
+    print(f"Saved to {output}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f"\nCompared with {args.compare} (commit {previous['environment'].get('commit')}):")
+        changed = sorted(
+            k for k, v in previous.get("parameters", {}).items()
+            if k not in ("output", "compare", "tolerance") and report["parameters"].get(k) != v
+        )
+        if changed:
+            print(f"Warning: parameters differ ({', '.join(changed)}); ratios may not be comparable")
+        for row in compare(report, previous, args.tolerance):
+            ratio = f"{row['ratio']:.2f}x" if row["ratio"] is not None else "n/a"
+            flag = {True: "better", False: "WORSE", None: ""}[row["better"]]
+            print(f"{row['metric']:45s} {row['previous']:12.3f} -> {row['current']:12.3f}  {ratio:>8s}  {flag}")
+
+
+if __name__ == "__main__":
+    main()
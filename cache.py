@@ -0,0 +1,271 @@
+"""
+Content-addressed response cache for every LLM call in the experiment.
+
+Responses are keyed by a hash of the full request (endpoint, model, messages,
+response_format and any sampling parameters), so re-running an analysis or a
+single stage after a prompt edit only queries the API for requests that
+actually changed. Wrap any client with CachedClient / AsyncCachedClient:
+
+    cache = DiskCache(".llm_cache", max_bytes=2 * 1024**3)
+    client = CachedClient(OpenAI(api_key=api_key), cache, mode="read_through")
+    results = run_experiment(client=client, ...)
+
+Modes:
+    read_through  - return cached responses, query and store on a miss
+    record        - always query the API and store the response
+    replay        - only return cached responses; a miss raises CacheMiss
+
+Identical requests share one cached response. Trials are meant to be
+independent samples, so give each trial its own `sample` id (the runner uses
+the trial index) - re-running trial i then replays trial i's responses.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from pydantic import BaseModel
+
+from backends import Namespace
+
+
+CACHE_MODES = ("read_through", "record", "replay")
+
+# DiskCache eviction deletes down to this fraction of max_bytes, so that it
+# runs once per many writes instead of on every write past the limit
+EVICT_TO = 0.9
+
+
+class CacheMiss(LookupError):
+    """Raised in replay mode when a request has no cached response."""
+
+
+class MemoryCache:
+    """
+    In-process LRU cache holding at most `max_entries` responses.
+
+    Safe to share between threads (e.g. the sync trajectory forks).
+    """
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key: str, value: dict) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DiskCache:
+    """
+    On-disk cache storing one JSON file per response under `directory`.
+
+    Files are sharded by the first two hex digits of the key. Reads refresh a
+    file's modification time, and once the cache grows past `max_bytes` the
+    least recently used files are deleted until it is back under
+    EVICT_TO * max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int | None = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(os.path.getsize(path) for path in self._files())
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _files(self) -> list[str]:
+        paths = []
+        for shard in os.listdir(self.directory):
+            shard_dir = os.path.join(self.directory, shard)
+            if os.path.isdir(shard_dir):
+                # Skip temporary files of writes in progress
+                paths.extend(os.path.join(shard_dir, name) for name in os.listdir(shard_dir) if name.endswith(".json"))
+        return paths
+
+    def get(self, key: str) -> dict | None:
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another thread since the read; the value is still good
+            pass
+        return value
+
+    def set(self, key: str, value: dict) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f)
+        with self._lock:
+            if os.path.exists(path):
+                self._size -= os.path.getsize(path)
+            os.replace(tmp_path, path)
+            self._size += os.path.getsize(path)
+            if self.max_bytes is not None and self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Delete least recently used entries until the cache is under the low-water mark."""
+        target = self.max_bytes * EVICT_TO
+        for path in sorted(self._files(), key=os.path.getmtime):
+            if self._size <= target:
+                break
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self._size -= size
+
+
+def cache_key(endpoint: str, request: dict, sample=None) -> str:
+    """
+    Hash a request into a cache key.
+
+    Args:
+        endpoint: "create" or "parse"
+        request: Keyword arguments of the call (model, messages, response_format, ...)
+        sample: Optional sample id distinguishing otherwise identical requests
+
+    Returns:
+        Hex SHA-256 digest of the canonical JSON encoding of the request
+    """
+    payload = {"endpoint": endpoint, "sample": sample}
+    for name, value in request.items():
+        if isinstance(value, type) and issubclass(value, BaseModel):
+            value = {"name": value.__name__, "schema": value.model_json_schema()}
+        payload[name] = value
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def _to_jsonable(obj):
+    """Convert an API response (pydantic model or plain object) into JSON data."""
+    if isinstance(obj, BaseModel):
+        obj = obj.model_dump(mode="json")
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        obj = vars(obj)
+    if isinstance(obj, dict):
+        # Parsed structured output is re-derived from the message content on load
+        return {k: _to_jsonable(v) for k, v in obj.items() if k != "parsed"}
+    if isinstance(obj, (list, tuple)):
+        return [_to_jsonable(v) for v in obj]
+    return obj
+
+
+def to_namespace(data):
+    """Turn cached JSON data back into an object with attribute access."""
+    if isinstance(data, dict):
+        return SimpleNamespace(**{k: to_namespace(v) for k, v in data.items()})
+    if isinstance(data, list):
+        return [to_namespace(v) for v in data]
+    return data
+
+
+def _from_cache(value: dict, response_format=None) -> SimpleNamespace:
+    response = to_namespace(value)
+    if response_format is not None:
+        for choice in response.choices:
+            content = choice.message.content
+            choice.message.parsed = response_format.model_validate_json(content) if content else None
+    response.from_cache = True
+    return response
+
+
+class _CacheLayer:
+    def __init__(self, cache, mode: str, sample):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"mode must be one of {CACHE_MODES}, got {mode!r}")
+        self.cache = cache
+        self.mode = mode
+        self.sample = sample
+
+    def lookup(self, endpoint: str, kwargs: dict) -> tuple[str, SimpleNamespace | None]:
+        key = cache_key(endpoint, kwargs, self.sample)
+        if self.mode == "record":
+            return key, None
+        value = self.cache.get(key)
+        if value is None:
+            if self.mode == "replay":
+                raise CacheMiss(f"No cached response for {endpoint} request {key[:12]} (model={kwargs.get('model')})")
+            return key, None
+        return key, _from_cache(value, kwargs.get("response_format"))
+
+    def store(self, key: str, response) -> None:
+        self.cache.set(key, _to_jsonable(response))
+
+
+class CachedClient:
+    """
+    Stand-in for OpenAI whose chat calls are served from a response cache.
+
+    Args:
+        client: Underlying OpenAI client (or compatible wrapper)
+        cache: MemoryCache, DiskCache or any object with get(key)/set(key, value)
+        mode: "read_through", "record" or "replay"
+        sample: Id mixed into every key so separate trials get separate samples
+    """
+
+    def __init__(self, client, cache, mode: str = "read_through", sample=None):
+        layer = _CacheLayer(cache, mode, sample)
+
+        def call(endpoint: str, fn, kwargs: dict):
+            key, cached = layer.lookup(endpoint, kwargs)
+            if cached is not None:
+                return cached
+            response = fn(**kwargs)
+            layer.store(key, response)
+            return response
+
+        self.chat = Namespace(completions=Namespace(
+            create=lambda **kw: call("create", client.chat.completions.create, kw),
+        ))
+        self.beta = Namespace(chat=Namespace(completions=Namespace(
+            parse=lambda **kw: call("parse", client.beta.chat.completions.parse, kw),
+        )))
+
+
+class AsyncCachedClient:
+    """Async counterpart of CachedClient, wrapping an AsyncOpenAI-like client."""
+
+    def __init__(self, client, cache, mode: str = "read_through", sample=None):
+        layer = _CacheLayer(cache, mode, sample)
+
+        async def call(endpoint: str, fn, kwargs: dict):
+            key, cached = layer.lookup(endpoint, kwargs)
+            if cached is not None:
+                return cached
+            response = await fn(**kwargs)
+            layer.store(key, response)
+            return response
+
+        self.chat = Namespace(completions=Namespace(
+            create=lambda **kw: call("create", client.chat.completions.create, kw),
+        ))
+        self.beta = Namespace(chat=Namespace(completions=Namespace(
+            parse=lambda **kw: call("parse", client.beta.chat.completions.parse, kw),
+        )))
@@ -0,0 +1,296 @@
+"""
+Append-only checkpoint log for streaming and resuming trials.
+
+Every finished step of a trial (each baseline answer, each conversation
+message, each context summary, each forked trajectory measurement, each post-survey answer) is appended to a JSONL log as soon as it
+arrives, so a crash mid-trial loses at most the calls that were in flight.
+`load_trials` rebuilds the partial trials from the log and
+`run_checkpointed_trial` continues a trial from its first missing step.
+
+Log records are one JSON object per line:
+    {"trial": id, "event": "start", "config": {...}}
+    {"trial": id, "event": "baseline", "question": question_id, "score": float}
+    {"trial": id, "event": "message", "index": int, "role": ..., "content": ...}
+    {"trial": id, "event": "measurement", "turn": int, "scores": {...}}
+    {"trial": id, "event": "summary", "messages": int, "summary": str}
+    {"trial": id, "event": "post", "question": question_id, "score": float}
+    {"trial": id, "event": "distribution", "stage": "baseline"|"post", "question": question_id,
+     "distribution": {score: probability}}
+    {"trial": id, "event": "done"}
+"""
+
+import asyncio
+import json
+import os
+import threading
+import uuid
+
+from openai import AsyncOpenAI
+
+from context import ContextCompactor
+from experiment import compact_history_async, experiment_result, measure_wvs_async, run_conversation_async
+from prompts import WVS_QUESTIONS
+from telemetry import Telemetry
+
+
+class CheckpointLog:
+    """
+    Durable append-only JSONL log shared by all trials of a run.
+
+    Records are flushed to the OS on every append, so they survive a crash of
+    the process. fsync (surviving a crash of the machine) is group-committed
+    by a background thread every `sync_interval` seconds, so appends never
+    wait on the disk; close() syncs whatever is left.
+
+    Args:
+        path: Path to the JSONL log
+        sync_interval: Seconds between fsyncs (0 to fsync on every append)
+    """
+
+    def __init__(self, path: str, sync_interval: float = 0.2):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a")
+        if self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # A crash mid-write left a truncated last line; don't glue the next record onto it
+                    self._file.write("\n")
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._closed = threading.Event()
+        self._syncer = None
+        if sync_interval > 0:
+            self._syncer = threading.Thread(target=self._sync_loop, name="checkpoint-fsync", daemon=True)
+            self._syncer.start()
+
+    def append(self, trial_id: str, event: str, **fields) -> None:
+        """Write one record and flush it to the OS before returning."""
+        record = {"trial": trial_id, "event": event, **fields}
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            self._dirty = True
+        if self._syncer is None:
+            self._sync()
+
+    def _sync(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            fileno = self._file.fileno()
+        os.fsync(fileno)
+
+    def _sync_loop(self) -> None:
+        while not self._closed.wait(self.sync_interval):
+            self._sync()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self._closed.set()
+        if self._syncer is not None:
+            self._syncer.join()
+        self._sync()
+        self._file.close()
+
+    def __enter__(self) -> "CheckpointLog":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def new_trial_id() -> str:
+    return uuid.uuid4().hex
+
+
+def load_trials(path: str) -> dict[str, dict]:
+    """
+    Rebuild the state of every trial recorded in a checkpoint log.
+
+    Args:
+        path: Path to the JSONL checkpoint log
+
+    Returns:
+        Dict mapping trial id to {"config", "baseline", "conversation",
+        "measurements", "summaries", "post", "distributions", "done"},
+        in the order the trials were started
+    """
+    trials = {}
+    if not os.path.exists(path):
+        return trials
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash mid-write can leave a truncated final line
+                continue
+            event = record["event"]
+            if event == "start":
+                trials[record["trial"]] = {
+                    "config": record["config"],
+                    "baseline": {},
+                    "conversation": [],
+                    "measurements": {},
+                    "summaries": {},
+                    "post": {},
+                    "distributions": {"baseline": {}, "post": {}},
+                    "done": False,
+                }
+                continue
+            trial = trials.get(record["trial"])
+            if trial is None:
+                continue
+            if event in ("baseline", "post"):
+                trial[event][record["question"]] = record["score"]
+            elif event == "message":
+                # Messages are appended in order; ignore duplicates from a retried write
+                if record["index"] == len(trial["conversation"]):
+                    trial["conversation"].append({"role": record["role"], "content": record["content"]})
+            elif event == "distribution":
+                trial["distributions"][record["stage"]][record["question"]] = record["distribution"]
+            elif event == "measurement":
+                trial["measurements"][record["turn"]] = record["scores"]
+            elif event == "summary":
+                trial["summaries"][record["messages"]] = record["summary"]
+            elif event == "done":
+                trial["done"] = True
+    return trials
+
+
+def unfinished_trials(path: str) -> dict[str, dict]:
+    """Trials in the log that never reached their "done" record."""
+    return {trial_id: trial for trial_id, trial in load_trials(path).items() if not trial["done"]}
+
+
+async def run_checkpointed_trial(
+    client: AsyncOpenAI,
+    log: CheckpointLog,
+    config: dict,
+    trial_id: str | None = None,
+    state: dict | None = None,
+    max_concurrency: int = 15,
+) -> dict:
+    """
+    Run (or resume) one trial, checkpointing every step to `log`.
+
+    Args:
+        client: AsyncOpenAI client instance (or a wrapper with the same interface)
+        log: Checkpoint log to append to
+        config: {"bot_model", "user_model", "n_turns", "survey_mode", "measure_every",
+            "context_policy"} for the trial
+        trial_id: Id of the trial; a new one is generated when omitted
+        state: Partial trial from load_trials to resume; None starts fresh
+        max_concurrency: Maximum number of survey requests in flight per measurement
+
+    Returns:
+        Result dict in the same format as run_experiment, plus "trial_id";
+        telemetry only covers the calls made in this (possibly resumed) run
+    """
+    if state is None:
+        trial_id = trial_id or new_trial_id()
+        state = {
+            "config": config,
+            "baseline": {},
+            "conversation": [],
+            "measurements": {},
+            "summaries": {},
+            "post": {},
+            "distributions": {"baseline": {}, "post": {}},
+            "done": False,
+        }
+        log.append(trial_id, "start", config=config)
+
+    bot_model = config["bot_model"]
+    n_turns = config["n_turns"]
+    # Logs written before survey modes existed were all per-question
+    survey_mode = config.get("survey_mode", "per_question")
+    telemetry = Telemetry()
+    conversation = state["conversation"]
+    measurements = state["measurements"]
+    distributions = state["distributions"]
+
+    def record_message(message: dict) -> None:
+        log.append(trial_id, "message", index=len(conversation), **message)
+        conversation.append(message)
+
+    def distribution_recorder(stage: str):
+        def record(question_id: str, distribution: dict[str, float]) -> None:
+            log.append(trial_id, "distribution", stage=stage, question=question_id, distribution=distribution)
+            distributions[stage][question_id] = distribution
+        return record
+
+    def record_measurement(turn: int, scores: dict[str, float]) -> None:
+        log.append(trial_id, "measurement", turn=turn, scores=scores)
+        measurements[turn] = scores
+
+    def record_summary(covered: int, summary: str) -> None:
+        log.append(trial_id, "summary", messages=covered, summary=summary)
+
+    # Logs written before context policies existed always sent the full history
+    context = None
+    if config.get("context_policy") is not None:
+        # Resumed trials reuse their logged summaries so the context stays identical
+        context = ContextCompactor(
+            config["context_policy"], summaries=state.get("summaries"), on_summary=record_summary
+        )
+
+    # 1 + 2. Remaining baseline answers and conversation turns in parallel
+    baseline, _ = await asyncio.gather(
+        measure_wvs_async(
+            client, bot_model, conversation_history=[], max_concurrency=max_concurrency,
+            answered=state["baseline"], survey_mode=survey_mode,
+            on_distribution=distribution_recorder("baseline"),
+            telemetry=telemetry, stage="baseline_survey",
+            on_answer=lambda qid, score: log.append(trial_id, "baseline", question=qid, score=score),
+        ),
+        run_conversation_async(
+            client, bot_model, config["user_model"], n_turns,
+            history=list(conversation), on_message=record_message,
+            measure_every=config.get("measure_every"), on_measurement=record_measurement,
+            measured=list(measurements), survey_mode=survey_mode, max_concurrency=max_concurrency,
+            telemetry=telemetry, context=context,
+        ),
+    )
+
+    # 3. Remaining post-interaction answers
+    post = await measure_wvs_async(
+        client, bot_model, conversation_history=await compact_history_async(client, context, conversation, telemetry),
+        max_concurrency=max_concurrency,
+        answered=state["post"], survey_mode=survey_mode,
+        on_distribution=distribution_recorder("post"),
+        telemetry=telemetry, stage="post_survey",
+        on_answer=lambda qid, score: log.append(trial_id, "post", question=qid, score=score),
+    )
+
+    result = experiment_result(
+        baseline, post, conversation, measurements, distributions, telemetry,
+        context.summaries if context is not None else None, **config,
+    )
+    return {"trial_id": trial_id, **result}
+
+
+def count_missing_steps(trial: dict) -> int:
+    """Number of API calls a partial trial still needs (for progress reporting)."""
+    n_turns = trial["config"]["n_turns"]
+    batched = trial["config"].get("survey_mode") == "batched"
+
+    def survey_calls(answered: dict) -> int:
+        missing = len(WVS_QUESTIONS) - len(answered)
+        return min(missing, 1) if batched else missing
+
+    measure_every = trial["config"].get("measure_every")
+    n_forks = len(range(measure_every, n_turns, measure_every)) if measure_every else 0
+    return (
+        survey_calls(trial["baseline"])
+        + 1 + 2 * n_turns - len(trial["conversation"])
+        + (n_forks - len(trial["measurements"])) * survey_calls({})
+        + survey_calls(trial["post"])
+    )
@@ -0,0 +1,159 @@
+"""
+Context budgeting for long conversations.
+
+Without a policy every bot and user turn re-sends the whole conversation, and
+each survey re-sends it once per question, so tokens grow quadratically with
+n_turns. A context policy bounds what each call sees:
+
+    "full"     the whole conversation (the default; no policy)
+    "window"   the most recent messages that fit in max_tokens
+    "pinned"   the opening message plus the recent_messages most recent ones
+    "summary"  a running LLM summary of older turns plus the recent_messages
+               most recent ones; older turns are folded into the summary in
+               blocks of summarize_every messages, so the summarised prefix
+               (and the provider's prompt cache) stays stable between blocks
+
+The same policy is applied to the bot turns, the user turns, the trajectory
+forks and the post survey, and the policy dict is recorded in the result's
+config as "context_policy".
+"""
+
+import asyncio
+from typing import Callable
+
+from prompts import CONTEXT_SUMMARY_NOTE, CONTEXT_SUMMARY_PROMPT
+
+
+CONTEXT_POLICIES = ("full", "window", "pinned", "summary")
+
+_DEFAULTS = {
+    "window": {"max_tokens": 8000},
+    "pinned": {"recent_messages": 8},
+    "summary": {"recent_messages": 8, "summarize_every": 8, "summary_model": "gpt-4o-mini"},
+}
+
+
+def context_policy(kind: str = "full", **options) -> dict | None:
+    """
+    Build a context policy dict, filling in defaults.
+
+    Args:
+        kind: "full", "window", "pinned" or "summary"
+        **options: max_tokens ("window"), recent_messages ("pinned", "summary"),
+            summarize_every and summary_model ("summary"); None values use the default
+
+    Returns:
+        The policy dict to pass as context_policy, or None for "full"
+    """
+    if kind not in CONTEXT_POLICIES:
+        raise ValueError(f"context policy must be one of {CONTEXT_POLICIES}, got {kind!r}")
+    if kind == "full":
+        return None
+    defaults = _DEFAULTS[kind]
+    unknown = set(k for k, v in options.items() if v is not None) - set(defaults)
+    if unknown:
+        raise ValueError(f"Options {sorted(unknown)} do not apply to the {kind!r} context policy")
+    return {"kind": kind, **defaults, **{k: v for k, v in options.items() if v is not None}}
+
+
+def _message_tokens(message: dict) -> int:
+    """Rough token count (~4 characters per token), as runner._estimate_tokens."""
+    return len(message.get("content") or "") // 4 + 4
+
+
+class ContextCompactor:
+    """
+    Applies a context policy to one conversation and holds its summaries.
+
+    Args:
+        policy: Policy dict from context_policy (None keeps the full history)
+        summaries: Summaries already made (e.g. from a checkpoint), keyed by
+            the number of leading messages each one covers
+        on_summary: Called with (covered, text) for each new summary
+    """
+
+    def __init__(
+        self,
+        policy: dict | None,
+        summaries: dict[int, str] | None = None,
+        on_summary: Callable[[int, str], None] | None = None,
+    ):
+        self.policy = policy
+        self.summaries = dict(summaries or {})
+        self.on_summary = on_summary
+        self._async_lock = None
+
+    @property
+    def async_lock(self) -> asyncio.Lock:
+        """Serializes summary calls between a conversation and its forks."""
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        return self._async_lock
+
+    def covered(self, n_messages: int) -> int:
+        """Number of leading messages replaced by the summary at this length."""
+        if self.policy is None or self.policy["kind"] != "summary":
+            return 0
+        older = n_messages - self.policy["recent_messages"]
+        every = self.policy["summarize_every"]
+        return max(older, 0) // every * every
+
+    def summary_request(self, history: list[dict]) -> tuple[int, dict] | None:
+        """
+        The summary call needed before `history` can be compacted, if any.
+
+        Returns:
+            (covered, request kwargs for chat.completions.create), or None
+            when the summary for this length already exists
+        """
+        covered = self.covered(len(history))
+        if covered == 0 or covered in self.summaries:
+            return None
+        previous = max((k for k in self.summaries if k < covered), default=0)
+        transcript = "\n\n".join(f"{m['role'].upper()}: {m['content']}" for m in history[previous:covered])
+        content = (
+            f"Current summary:\n{self.summaries.get(previous, '(none)')}\n\n"
+            f"Next part of the conversation:\n{transcript}"
+        )
+        return covered, {
+            "model": self.policy["summary_model"],
+            "messages": [
+                {"role": "system", "content": CONTEXT_SUMMARY_PROMPT},
+                {"role": "user", "content": content},
+            ],
+        }
+
+    def add_summary(self, covered: int, text: str) -> None:
+        self.summaries[covered] = text
+        if self.on_summary is not None:
+            self.on_summary(covered, text)
+
+    def view(self, history: list[dict], role: str = "assistant") -> list[dict]:
+        """
+        The part of a bot-perspective history that a call gets to see.
+
+        Args:
+            history: Conversation from the bot's perspective
+            role: Whose call this is, for the summary note: "assistant" for
+                the bot, "user" for the user LLM (which flips the roles itself)
+        """
+        if self.policy is None:
+            return list(history)
+        kind = self.policy["kind"]
+        if kind == "window":
+            kept, budget = 0, self.policy["max_tokens"]
+            for message in reversed(history):
+                budget -= _message_tokens(message)
+                # The newest message is always kept, even if it alone is over budget
+                if budget < 0 and kept:
+                    break
+                kept += 1
+            return history[len(history) - kept:]
+        if kind == "pinned":
+            recent = self.policy["recent_messages"]
+            return history[:1] + history[max(1, len(history) - recent):]
+        covered = self.covered(len(history))
+        if covered == 0:
+            return list(history)
+        note = CONTEXT_SUMMARY_NOTE.format(role=role, summary=self.summaries[covered])
+        return [{"role": "system", "content": note}] + history[covered:]
@@ -1,25 +1,224 @@
 """
 Core experiment functions for measuring WEIRD bias drift in LLMs.
 
-All functions are designed to be called from a notebook.
+All functions are designed to be called from a notebook. The *_async variants
+run on AsyncOpenAI and can be awaited directly in a notebook cell.
 """
 
-from openai import OpenAI
+import asyncio
+import math
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from typing import Callable, Iterable
 
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+from backends import Namespace
+from context import ContextCompactor
+from telemetry import Telemetry
 from prompts import (
     WVS_QUESTIONS,
     BOT_SYSTEM_PROMPT,
     BOT_SURVEY_PROMPT,
+    BOT_BATCH_SURVEY_PROMPT,
+    BOT_LOGPROB_SURVEY_PROMPT,
     USER_SYSTEM_PROMPT,
     CONVERSATION_TOPIC,
     SurveyResponse,
+    BatchedSurveyResponse,
+    build_batched_survey_response,
+    format_batched_survey,
 )
 
+# "per_question": one structured-output request per WVS question
+# "batched": a single request returning every score at once
+# "logprobs": one request per question, scored as the probability-weighted
+#             expected value over the top-k score tokens
+SURVEY_MODES = ("per_question", "batched", "logprobs")
+
+# Maximum number of alternatives the API returns per token
+TOP_LOGPROBS = 20
+
+
+def _call(endpoint: Callable, telemetry: Telemetry | None, stage: str, **kwargs):
+    """Make one API call, recording it under `stage` when telemetry is enabled."""
+    if telemetry is None:
+        return endpoint(**kwargs)
+    with telemetry.track(stage, kwargs["model"]) as call:
+        call["response"] = endpoint(**kwargs)
+    return call["response"]
+
+
+async def _acall(endpoint: Callable, telemetry: Telemetry | None, stage: str, **kwargs):
+    """Async version of _call."""
+    if telemetry is None:
+        return await endpoint(**kwargs)
+    with telemetry.track(stage, kwargs["model"]) as call:
+        call["response"] = await endpoint(**kwargs)
+    return call["response"]
+
+
+def survey_messages(question: dict, conversation_history: list[dict]) -> list[dict]:
+    """Build messages: system prompt + conversation history + WVS question."""
+    messages = [{"role": "system", "content": BOT_SURVEY_PROMPT}]
+    messages.extend(conversation_history)
+    messages.append({"role": "user", "content": question["text"]})
+    return messages
+
+
+def batched_survey_request(questions: list[dict], conversation_history: list[dict]) -> dict:
+    """Build the messages and response format for a single all-questions survey call."""
+    messages = [{"role": "system", "content": BOT_BATCH_SURVEY_PROMPT}]
+    messages.extend(conversation_history)
+    messages.append({"role": "user", "content": format_batched_survey(questions)})
+    if len(questions) == len(WVS_QUESTIONS):
+        response_format = BatchedSurveyResponse
+    else:
+        # Resuming a partially answered survey: only ask for what is missing
+        response_format = build_batched_survey_response(questions)
+    return {"messages": messages, "response_format": response_format}
+
+
+def batched_scores(response, questions: list[dict]) -> dict[str, float]:
+    """Extract per-question scores from a batched survey response."""
+    parsed = response.choices[0].message.parsed
+    scores = {question["id"]: float(getattr(parsed, question["id"])) for question in questions}
+    print(f"batched survey: {scores} (caveat: {parsed.caveat})")
+    return scores
+
+
+def _logprob_survey_request(question: dict, conversation_history: list[dict]) -> dict:
+    """Build a plain completion request exposing the score token's top-k logprobs."""
+    prompt = BOT_LOGPROB_SURVEY_PROMPT.format(scale_min=question["scale_min"], scale_max=question["scale_max"])
+    messages = [{"role": "system", "content": prompt}]
+    messages.extend(conversation_history)
+    messages.append({"role": "user", "content": question["text"]})
+    # "10" is a single token for GPT-4-era tokenizers, so one token covers the scale
+    return {"messages": messages, "logprobs": True, "top_logprobs": TOP_LOGPROBS, "max_tokens": 1}
+
+
+def _expected_score(response, question: dict) -> tuple[float, dict[str, float]] | None:
+    """
+    Turn the first token's top logprobs into an expected score and distribution.
+    
+    Returns None when the response carries no usable logprobs (unsupported
+    model or no in-scale token among the alternatives), so the caller can fall
+    back to the sampled structured-output answer.
+    """
+    logprobs = getattr(response.choices[0], "logprobs", None)
+    if logprobs is None or not logprobs.content:
+        return None
+    weights = {}
+    for alternative in logprobs.content[0].top_logprobs:
+        token = alternative.token.strip()
+        # isdecimal, not isdigit: int() rejects digits like "²"
+        if token.isdecimal() and question["scale_min"] <= int(token) <= question["scale_max"]:
+            # Variants like "7" and " 7" are the same answer
+            weights[int(token)] = weights.get(int(token), 0.0) + math.exp(alternative.logprob)
+    total = sum(weights.values())
+    if total == 0:
+        return None
+    distribution = {
+        str(value): weights.get(value, 0.0) / total
+        for value in range(question["scale_min"], question["scale_max"] + 1)
+    }
+    expected = sum(int(value) * p for value, p in distribution.items())
+    return expected, distribution
+
+
+def check_survey_mode(survey_mode: str) -> None:
+    if survey_mode not in SURVEY_MODES:
+        raise ValueError(f"survey_mode must be one of {SURVEY_MODES}, got {survey_mode!r}")
+
+
+def _measurement_turns(n_turns: int, measure_every: int | None) -> range:
+    """Turns after which a trajectory measurement is forked (the last turn is the post survey)."""
+    if not measure_every:
+        return range(0)
+    return range(measure_every, n_turns, measure_every)
+
+
+def opener_messages(persona: str | None = None, topic: str | None = None) -> list[dict]:
+    """Messages asking the user LLM to open the conversation on the topic."""
+    return [
+        {"role": "system", "content": persona or USER_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Start a conversation about: {topic or CONVERSATION_TOPIC}"},
+    ]
+
+
+def flip_roles(bot_history: list[dict]) -> list[dict]:
+    """Convert a bot-perspective history into the user LLM's perspective."""
+    flipped = {"user": "assistant", "assistant": "user"}
+    # System notes (e.g. a context summary) keep their role
+    return [{"role": flipped.get(m["role"], m["role"]), "content": m["content"]} for m in bot_history]
+
+
+def _cancellable(client: OpenAI, cancelled: threading.Event) -> Namespace:
+    """View of a sync client whose calls raise CancelledError once `cancelled` is set."""
+
+    def guard(endpoint: Callable) -> Callable:
+        def call(**kwargs):
+            if cancelled.is_set():
+                raise CancelledError("Trial failed; forked measurement cancelled")
+            return endpoint(**kwargs)
+        return call
+
+    return Namespace(
+        chat=Namespace(completions=Namespace(create=guard(client.chat.completions.create))),
+        beta=Namespace(chat=Namespace(completions=Namespace(parse=guard(client.beta.chat.completions.parse)))),
+    )
+
+
+def compact_history(
+    client: OpenAI,
+    context: ContextCompactor | None,
+    history: list[dict],
+    telemetry: Telemetry | None,
+    role: str = "assistant",
+) -> list[dict]:
+    """
+    Apply the context policy to a bot-perspective history (a new list).
+
+    Under the "summary" policy, first makes the summary call when one is due.
+    """
+    if context is None:
+        return list(history)
+    request = context.summary_request(history)
+    if request is not None:
+        covered, kwargs = request
+        response = _call(client.chat.completions.create, telemetry, "summary", **kwargs)
+        context.add_summary(covered, response.choices[0].message.content)
+    return context.view(history, role)
+
+
+async def compact_history_async(
+    client: AsyncOpenAI,
+    context: ContextCompactor | None,
+    history: list[dict],
+    telemetry: Telemetry | None,
+    role: str = "assistant",
+) -> list[dict]:
+    """Async version of compact_history; forks and the conversation share one summary per block."""
+    if context is None:
+        return list(history)
+    async with context.async_lock:
+        request = context.summary_request(history)
+        if request is not None:
+            covered, kwargs = request
+            response = await _acall(client.chat.completions.create, telemetry, "summary", **kwargs)
+            context.add_summary(covered, response.choices[0].message.content)
+    return context.view(history, role)
+
 
 def measure_wvs(
     client: OpenAI,
     model: str,
     conversation_history: list[dict],
+    survey_mode: str = "per_question",
+    on_distribution: Callable[[str, dict[str, float]], None] | None = None,
+    telemetry: Telemetry | None = None,
+    stage: str = "survey",
 ) -> dict[str, float]:
     """
     Administer WVS questions to the LLM and extract numeric responses.
@@ -28,21 +227,51 @@ def measure_wvs(
         client: OpenAI client instance
         model: Model name (e.g., "gpt-4o")
         conversation_history: Prior conversation context (empty list for baseline)
+        survey_mode: "per_question" (one request per question), "batched"
+            (one request for all questions) or "logprobs" (expected score from
+            the score token's top-k logprobs, falling back to "per_question"
+            for any question where logprobs are unavailable)
+        on_distribution: In "logprobs" mode, called with (question_id,
+            {score: probability}) for each question scored from logprobs
+        telemetry: Collector to record every call to (None to disable)
+        stage: Stage name for telemetry, e.g. "baseline_survey" or "post_survey"
     
     Returns:
         Dict mapping question_id to numeric score
     """
+    check_survey_mode(survey_mode)
+    if survey_mode == "batched":
+        response = _call(
+            client.beta.chat.completions.parse, telemetry, stage,
+            model=model,
+            **batched_survey_request(WVS_QUESTIONS, conversation_history),
+        )
+        return batched_scores(response, WVS_QUESTIONS)
+    
     scores = {}
     
     for question in WVS_QUESTIONS:
-        # Build messages: system prompt + conversation history + WVS question
-        messages = [{"role": "system", "content": BOT_SURVEY_PROMPT}]
-        messages.extend(conversation_history)
-        messages.append({"role": "user", "content": question["text"]})
+        if survey_mode == "logprobs":
+            try:
+                response = _call(
+                    client.chat.completions.create, telemetry, stage,
+                    model=model, **_logprob_survey_request(question, conversation_history)
+                )
+                estimate = _expected_score(response, question)
+            except openai.BadRequestError:
+                # Model does not support logprobs
+                estimate = None
+            if estimate is not None:
+                scores[question["id"]], distribution = estimate
+                print(f"{question['id']}: {scores[question['id']]:.2f} (expected from logprobs)")
+                if on_distribution is not None:
+                    on_distribution(question["id"], distribution)
+                continue
         
-        response = client.beta.chat.completions.parse(
+        response = _call(
+            client.beta.chat.completions.parse, telemetry, stage,
             model=model,
-            messages=messages,
+            messages=survey_messages(question, conversation_history),
             response_format=SurveyResponse,
         )
         survey_response: SurveyResponse = response.choices[0].message.parsed
@@ -53,70 +282,376 @@ def measure_wvs(
     return scores
 
 
+async def measure_wvs_async(
+    client: AsyncOpenAI,
+    model: str,
+    conversation_history: list[dict],
+    max_concurrency: int = 15,
+    answered: dict[str, float] | None = None,
+    on_answer: Callable[[str, float], None] | None = None,
+    survey_mode: str = "per_question",
+    on_distribution: Callable[[str, dict[str, float]], None] | None = None,
+    telemetry: Telemetry | None = None,
+    stage: str = "survey",
+) -> dict[str, float]:
+    """
+    Async version of measure_wvs that asks all WVS questions concurrently.
+    
+    Every question only depends on the same conversation history, so the
+    requests are fanned out at once (at most max_concurrency in flight) and
+    the scores are returned in WVS_QUESTIONS order.
+    
+    Args:
+        client: AsyncOpenAI client instance
+        model: Model name (e.g., "gpt-4o")
+        conversation_history: Prior conversation context (empty list for baseline)
+        max_concurrency: Maximum number of survey requests in flight at once
+        answered: Scores already collected (e.g. from a checkpoint); these
+            questions are not asked again
+        on_answer: Called with (question_id, score) as soon as each answer arrives
+        survey_mode: "per_question" (one request per question), "batched"
+            (one request for all unanswered questions) or "logprobs" (see measure_wvs)
+        on_distribution: In "logprobs" mode, called with (question_id,
+            {score: probability}) for each question scored from logprobs
+        telemetry: Collector to record every call to (None to disable)
+        stage: Stage name for telemetry (see measure_wvs)
+    
+    Returns:
+        Dict mapping question_id to numeric score
+    """
+    check_survey_mode(survey_mode)
+    answered = answered or {}
+    
+    if survey_mode == "batched":
+        missing = [question for question in WVS_QUESTIONS if question["id"] not in answered]
+        scores = {}
+        if missing:
+            response = await _acall(
+                client.beta.chat.completions.parse, telemetry, stage,
+                model=model,
+                **batched_survey_request(missing, conversation_history),
+            )
+            scores = batched_scores(response, missing)
+            if on_answer is not None:
+                for question_id, score in scores.items():
+                    on_answer(question_id, score)
+        return {q["id"]: answered.get(q["id"], scores.get(q["id"])) for q in WVS_QUESTIONS}
+    
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def ask(question: dict) -> float:
+        if question["id"] in answered:
+            return answered[question["id"]]
+        async with semaphore:
+            estimate = None
+            if survey_mode == "logprobs":
+                try:
+                    response = await _acall(
+                        client.chat.completions.create, telemetry, stage,
+                        model=model, **_logprob_survey_request(question, conversation_history)
+                    )
+                    estimate = _expected_score(response, question)
+                except openai.BadRequestError:
+                    # Model does not support logprobs
+                    pass
+            if estimate is None:
+                response = await _acall(
+                    client.beta.chat.completions.parse, telemetry, stage,
+                    model=model,
+                    messages=survey_messages(question, conversation_history),
+                    response_format=SurveyResponse,
+                )
+        if estimate is not None:
+            score, distribution = estimate
+            print(f"{question['id']}: {score:.2f} (expected from logprobs)")
+            if on_distribution is not None:
+                on_distribution(question["id"], distribution)
+        else:
+            survey_response: SurveyResponse = response.choices[0].message.parsed
+            print(f"{question['id']}: {survey_response.response} (caveat: {survey_response.caveat})")
+            score = float(survey_response.response)
+        if on_answer is not None:
+            on_answer(question["id"], score)
+        return score
+    
+    # gather preserves argument order, so scores line up with WVS_QUESTIONS
+    responses = await asyncio.gather(*(ask(question) for question in WVS_QUESTIONS))
+    return {question["id"]: score for question, score in zip(WVS_QUESTIONS, responses)}
+
+
 def run_conversation(
     client: OpenAI,
     bot_model: str,
     user_model: str,
     n_turns: int,
+    measure_every: int | None = None,
+    on_measurement: Callable[[int, dict[str, float]], None] | None = None,
+    survey_mode: str = "per_question",
+    telemetry: Telemetry | None = None,
+    context: ContextCompactor | None = None,
+    persona: str | None = None,
+    topic: str | None = None,
 ) -> list[dict]:
     """
     Run N back-and-forth exchanges between bot and user LLMs.
     
     The user LLM initiates with the conversation topic.
     
+    With measure_every=k, a measure_wvs pass is forked off the running
+    conversation after every k-th exchange (before the last one, which the
+    post survey covers). Forks run in background threads while the
+    conversation continues, and each fork's history is a snapshot of the
+    shared prefix, so the request prefixes stay byte-identical across forks
+    and the provider's prompt caching applies.
+    
     Args:
         client: OpenAI client instance
         bot_model: Model for the bot LLM (the one we measure)
         user_model: Model for the user LLM (non-WEIRD prompted)
         n_turns: Number of back-and-forth exchanges
+        measure_every: Fork a survey every this many exchanges (None to disable)
+        on_measurement: Called with (turn, scores) for each fork, in turn order,
+            once the conversation and all forks have finished
+        survey_mode: Survey mode for the forked measurements (see measure_wvs)
+        telemetry: Collector to record every call to (None to disable)
+        context: Context policy applied to every turn and fork (None sends
+            the full history; see context.py)
+        persona: System prompt of the user LLM (default: USER_SYSTEM_PROMPT)
+        topic: Conversation topic (default: CONVERSATION_TOPIC)
     
     Returns:
         Conversation history as list of {"role": ..., "content": ...} dicts
         (from the bot's perspective: user messages are "user", bot messages are "assistant")
     """
-    # Conversation history from bot's perspective
-    bot_history = []
-    # Conversation history from user's perspective (roles are flipped)
-    user_history = []
+    forks = {}
+    executor = ThreadPoolExecutor() if measure_every else None
+    cancelled = threading.Event()
+    fork_client = _cancellable(client, cancelled)
     
-    # User LLM initiates with the topic
-    user_messages = [
-        {"role": "system", "content": USER_SYSTEM_PROMPT},
-        {"role": "user", "content": f"Start a conversation about: {CONVERSATION_TOPIC}"},
-    ]
-    response = client.chat.completions.create(model=user_model, messages=user_messages)
-    user_message = response.choices[0].message.content
-    
-    # Add to histories
-    bot_history.append({"role": "user", "content": user_message})
-    user_history.append({"role": "assistant", "content": user_message})
-    
-    # Alternate turns
-    for _ in range(n_turns):
-        # Bot responds
-        bot_messages = [{"role": "system", "content": BOT_SYSTEM_PROMPT}] + bot_history
-        response = client.chat.completions.create(model=bot_model, messages=bot_messages)
-        bot_message = response.choices[0].message.content
-        
-        bot_history.append({"role": "assistant", "content": bot_message})
-        user_history.append({"role": "user", "content": bot_message})
-        
-        # User responds
-        user_messages = [{"role": "system", "content": USER_SYSTEM_PROMPT}] + user_history
-        response = client.chat.completions.create(model=user_model, messages=user_messages)
+    try:
+        # Conversation history from bot's perspective; the user LLM sees it with roles flipped
+        bot_history = []
+
+        # User LLM initiates with the topic
+        response = _call(
+            client.chat.completions.create, telemetry, "opener",
+            model=user_model, messages=opener_messages(persona, topic),
+        )
         user_message = response.choices[0].message.content
-        
+
         bot_history.append({"role": "user", "content": user_message})
-        user_history.append({"role": "assistant", "content": user_message})
+
+        # Alternate turns
+        for turn in range(1, n_turns + 1):
+            # Bot responds
+            bot_messages = [{"role": "system", "content": BOT_SYSTEM_PROMPT}] + compact_history(
+                client, context, bot_history, telemetry
+            )
+            response = _call(
+                client.chat.completions.create, telemetry, "bot_turn", model=bot_model, messages=bot_messages
+            )
+            bot_message = response.choices[0].message.content
+
+            bot_history.append({"role": "assistant", "content": bot_message})
+
+            # User responds
+            user_messages = [{"role": "system", "content": persona or USER_SYSTEM_PROMPT}] + flip_roles(
+                compact_history(client, context, bot_history, telemetry, role="user")
+            )
+            response = _call(
+                client.chat.completions.create, telemetry, "user_turn", model=user_model, messages=user_messages
+            )
+            user_message = response.choices[0].message.content
+
+            bot_history.append({"role": "user", "content": user_message})
+
+            if turn in _measurement_turns(n_turns, measure_every):
+                # Compacted here so that any summary call happens once, outside the fork
+                forks[turn] = executor.submit(
+                    measure_wvs, fork_client, bot_model, compact_history(client, context, bot_history, telemetry),
+                    survey_mode=survey_mode, telemetry=telemetry, stage="trajectory_survey",
+                )
+    except BaseException:
+        # Otherwise the forks would keep calling the API for a failed trial:
+        # queued ones are dropped, running ones stop at their next call
+        cancelled.set()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    
+    if executor is not None:
+        executor.shutdown(wait=True)
+        for turn, fork in forks.items():
+            if on_measurement is not None:
+                on_measurement(turn, fork.result())
+    
+    return bot_history
+
+
+async def run_conversation_async(
+    client: AsyncOpenAI,
+    bot_model: str,
+    user_model: str,
+    n_turns: int,
+    history: list[dict] | None = None,
+    on_message: Callable[[dict], None] | None = None,
+    measure_every: int | None = None,
+    on_measurement: Callable[[int, dict[str, float]], None] | None = None,
+    measured: Iterable[int] = (),
+    survey_mode: str = "per_question",
+    max_concurrency: int = 15,
+    telemetry: Telemetry | None = None,
+    context: ContextCompactor | None = None,
+    persona: str | None = None,
+    topic: str | None = None,
+) -> list[dict]:
+    """
+    Async version of run_conversation.
+    
+    Turns are inherently sequential, so this only awaits each call in turn; its
+    purpose is to let the conversation run alongside other coroutines. Forked
+    trajectory measurements (measure_every) run as tasks alongside the
+    remaining turns.
+    
+    Args:
+        client: AsyncOpenAI client instance
+        bot_model: Model for the bot LLM (the one we measure)
+        user_model: Model for the user LLM (non-WEIRD prompted)
+        n_turns: Number of back-and-forth exchanges
+        history: Partial conversation (bot's perspective) to continue from,
+            e.g. when resuming a checkpointed trial
+        on_message: Called with each new message as soon as it is generated
+        measure_every: Fork a survey every this many exchanges (None to disable)
+        on_measurement: Called with (turn, scores) as soon as each fork finishes
+        measured: Turns already measured (e.g. from a checkpoint); not re-forked
+        survey_mode: Survey mode for the forked measurements (see measure_wvs)
+        max_concurrency: Maximum number of survey requests in flight per fork
+        telemetry: Collector to record every call to (None to disable)
+        context: Context policy applied to every turn and fork (see run_conversation)
+        persona: System prompt of the user LLM (default: USER_SYSTEM_PROMPT)
+        topic: Conversation topic (default: CONVERSATION_TOPIC)
+    
+    Returns:
+        Conversation history from the bot's perspective (see run_conversation)
+    """
+    bot_history = list(history or [])
+    pending_turns = set(_measurement_turns(n_turns, measure_every)) - set(measured)
+    forks = []
+    
+    async def measure(turn: int, prefix: list[dict]) -> None:
+        scores = await measure_wvs_async(
+            client, bot_model, await compact_history_async(client, context, prefix, telemetry),
+            max_concurrency=max_concurrency, survey_mode=survey_mode,
+            telemetry=telemetry, stage="trajectory_survey",
+        )
+        if on_measurement is not None:
+            on_measurement(turn, scores)
+    
+    def fork_measurements() -> None:
+        # A turn is complete once its user message lands (opener + 2 messages per turn)
+        for turn in sorted(pending_turns):
+            if 1 + 2 * turn <= len(bot_history):
+                pending_turns.discard(turn)
+                forks.append(asyncio.create_task(measure(turn, bot_history[:1 + 2 * turn])))
+    
+    def append(bot_role: str, content: str) -> None:
+        bot_history.append({"role": bot_role, "content": content})
+        if on_message is not None:
+            on_message(bot_history[-1])
+        fork_measurements()
+    
+    # Forks for turns already in a resumed history
+    fork_measurements()
+    try:
+        if not bot_history:
+            # User LLM initiates with the topic
+            response = await _acall(
+                client.chat.completions.create, telemetry, "opener",
+                model=user_model, messages=opener_messages(persona, topic),
+            )
+            append("user", response.choices[0].message.content)
+        
+        # Opener + a bot and a user message per turn; picks up mid-turn when resuming
+        while len(bot_history) < 1 + 2 * n_turns:
+            if bot_history[-1]["role"] == "user":
+                bot_messages = [{"role": "system", "content": BOT_SYSTEM_PROMPT}] + await compact_history_async(
+                    client, context, bot_history, telemetry
+                )
+                response = await _acall(
+                    client.chat.completions.create, telemetry, "bot_turn", model=bot_model, messages=bot_messages
+                )
+                append("assistant", response.choices[0].message.content)
+            else:
+                user_messages = [{"role": "system", "content": persona or USER_SYSTEM_PROMPT}] + flip_roles(
+                    await compact_history_async(client, context, bot_history, telemetry, role="user")
+                )
+                response = await _acall(
+                    client.chat.completions.create, telemetry, "user_turn", model=user_model, messages=user_messages
+                )
+                append("user", response.choices[0].message.content)
+        
+        await asyncio.gather(*forks)
+    finally:
+        # Don't leave orphaned measurements running if a turn failed
+        for fork in forks:
+            fork.cancel()
     
     return bot_history
 
 
+def experiment_result(
+    baseline: dict[str, float],
+    post: dict[str, float],
+    conversation: list[dict],
+    measurements: dict[int, dict[str, float]],
+    distributions: dict[str, dict] | None = None,
+    telemetry: Telemetry | None = None,
+    summaries: dict[int, str] | None = None,
+    **config,
+) -> dict:
+    """
+    Assemble the result dict saved for each trial.
+
+    Args:
+        baseline: Baseline scores
+        post: Post-conversation scores
+        conversation: Conversation from the bot's perspective
+        measurements: Forked measurements by turn (used when config has measure_every)
+        distributions: Logprob score distributions by stage (dropped if all empty)
+        telemetry: Call records of the trial
+        summaries: Context summaries by number of messages covered
+        **config: Stored as result["config"]
+    """
+    if telemetry is not None:
+        config["telemetry"] = telemetry.to_dict()
+    result = {
+        "baseline": baseline,
+        "post": post,
+        "conversation": conversation,
+        "config": config,
+    }
+    if config.get("measure_every"):
+        # Full dose-response curve: baseline at turn 0, forks, post at n_turns
+        points = {0: baseline, **measurements, config["n_turns"]: post}
+        result["trajectory"] = [{"turn": turn, "scores": points[turn]} for turn in sorted(points)]
+    if distributions and any(distributions.values()):
+        # Per-question score distributions from logprobs, keyed by stage
+        result["distributions"] = distributions
+    if summaries:
+        # Running summaries of the "summary" context policy, by messages covered
+        result["summaries"] = [{"messages": covered, "summary": summaries[covered]} for covered in sorted(summaries)]
+    return result
+
+
 def run_experiment(
-    api_key: str,
+    api_key: str | None = None,
     bot_model: str = "gpt-4o",
     user_model: str = "gpt-4o",
     n_turns: int = 5,
+    client: OpenAI | None = None,
+    survey_mode: str = "per_question",
+    measure_every: int | None = None,
+    context_policy: dict | None = None,
 ) -> dict:
     """
     Run the full experiment pipeline.
@@ -126,29 +661,122 @@ def run_experiment(
         bot_model: Model for the bot LLM (the one we measure for drift)
         user_model: Model for the user LLM (prompted with non-WEIRD values)
         n_turns: Number of conversation turns
+        client: Pre-built client (e.g. a cache.CachedClient); when given,
+            api_key is ignored
+        survey_mode: "per_question", "batched" or "logprobs" (see measure_wvs);
+            in "logprobs" mode the result also holds the score "distributions"
+        measure_every: Also measure every this many turns during the
+            conversation (see run_conversation) and add a "trajectory"
+        context_policy: Context policy from context.context_policy, applied to
+            the conversation and the post survey (None sends the full history)
     
     Returns:
-        Dict with baseline scores, post scores, and conversation
+        Dict with baseline scores, post scores, and conversation; per-call
+        token/latency/cost telemetry is stored in config["telemetry"]
     """
-    client = OpenAI(api_key=api_key)
+    if client is None:
+        client = OpenAI(api_key=api_key)
+    telemetry = Telemetry()
+    context = ContextCompactor(context_policy) if context_policy is not None else None
     
     # 1. Baseline measurement (empty conversation history)
-    baseline = measure_wvs(client, bot_model, conversation_history=[])
+    distributions = {"baseline": {}, "post": {}}
+    baseline = measure_wvs(
+        client, bot_model, conversation_history=[], survey_mode=survey_mode,
+        on_distribution=distributions["baseline"].__setitem__,
+        telemetry=telemetry, stage="baseline_survey",
+    )
     
     # 2. Run conversation
-    conversation = run_conversation(client, bot_model, user_model, n_turns)
+    measurements = {}
+    conversation = run_conversation(
+        client, bot_model, user_model, n_turns,
+        measure_every=measure_every, on_measurement=measurements.__setitem__, survey_mode=survey_mode,
+        telemetry=telemetry, context=context,
+    )
     
-    # 3. Post-interaction measurement (with conversation history)
-    post = measure_wvs(client, bot_model, conversation_history=conversation)
+    # 3. Post-interaction measurement (with conversation history, compacted like the conversation)
+    post = measure_wvs(
+        client, bot_model, conversation_history=compact_history(client, context, conversation, telemetry),
+        survey_mode=survey_mode,
+        on_distribution=distributions["post"].__setitem__,
+        telemetry=telemetry, stage="post_survey",
+    )
     
-    return {
-        "baseline": baseline,
-        "post": post,
-        "conversation": conversation,
-        "config": {
-            "bot_model": bot_model,
-            "user_model": user_model,
-            "n_turns": n_turns,
-        },
-    }
+    return experiment_result(
+        baseline, post, conversation, measurements, distributions, telemetry,
+        context.summaries if context is not None else None,
+        bot_model=bot_model, user_model=user_model, n_turns=n_turns,
+        survey_mode=survey_mode, measure_every=measure_every, context_policy=context_policy,
+    )
 
+
+async def run_experiment_async(
+    api_key: str | None = None,
+    bot_model: str = "gpt-4o",
+    user_model: str = "gpt-4o",
+    n_turns: int = 5,
+    max_concurrency: int = 15,
+    client: AsyncOpenAI | None = None,
+    survey_mode: str = "per_question",
+    measure_every: int | None = None,
+    context_policy: dict | None = None,
+) -> dict:
+    """
+    Async version of run_experiment.
+    
+    The baseline survey does not depend on the conversation, so it runs
+    concurrently with it; each survey fans out its questions concurrently.
+    
+    Args:
+        api_key: OpenAI API key
+        bot_model: Model for the bot LLM (the one we measure for drift)
+        user_model: Model for the user LLM (prompted with non-WEIRD values)
+        n_turns: Number of conversation turns
+        max_concurrency: Maximum number of survey requests in flight per measurement
+        client: Pre-built async client (e.g. a rate-limited wrapper shared across
+            trials); when given, api_key is ignored
+        survey_mode: "per_question", "batched" or "logprobs" (see measure_wvs)
+        measure_every: Also measure every this many turns during the
+            conversation (see run_conversation_async) and add a "trajectory"
+        context_policy: Context policy (see run_experiment)
+    
+    Returns:
+        Dict with baseline scores, post scores, and conversation; per-call
+        token/latency/cost telemetry is stored in config["telemetry"]
+    """
+    if client is None:
+        client = AsyncOpenAI(api_key=api_key)
+    telemetry = Telemetry()
+    context = ContextCompactor(context_policy) if context_policy is not None else None
+    
+    # 1 + 2. Baseline measurement and conversation in parallel
+    measurements = {}
+    distributions = {"baseline": {}, "post": {}}
+    baseline, conversation = await asyncio.gather(
+        measure_wvs_async(
+            client, bot_model, conversation_history=[], max_concurrency=max_concurrency,
+            survey_mode=survey_mode, on_distribution=distributions["baseline"].__setitem__,
+            telemetry=telemetry, stage="baseline_survey",
+        ),
+        run_conversation_async(
+            client, bot_model, user_model, n_turns,
+            measure_every=measure_every, on_measurement=measurements.__setitem__,
+            survey_mode=survey_mode, max_concurrency=max_concurrency, telemetry=telemetry, context=context,
+        ),
+    )
+    
+    # 3. Post-interaction measurement (with conversation history, compacted like the conversation)
+    post = await measure_wvs_async(
+        client, bot_model, conversation_history=await compact_history_async(client, context, conversation, telemetry),
+        max_concurrency=max_concurrency,
+        survey_mode=survey_mode, on_distribution=distributions["post"].__setitem__,
+        telemetry=telemetry, stage="post_survey",
+    )
+    
+    return experiment_result(
+        baseline, post, conversation, measurements, distributions, telemetry,
+        context.summaries if context is not None else None,
+        bot_model=bot_model, user_model=user_model, n_turns=n_turns,
+        survey_mode=survey_mode, measure_every=measure_every, context_policy=context_policy,
+    )
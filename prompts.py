@@ -13,7 +13,9 @@ All prompts are placeholders - edit these to optimize the experiment.
 #
 # PLACEHOLDER: Replace with actual WVS questions or custom measures of WEIRDness
 # ------------------------------------------------------------------------------
-from pydantic import BaseModel
+from typing import Annotated
+
+from pydantic import BaseModel, Field, create_model
 
 
 class SurveyResponse(BaseModel):
@@ -144,6 +146,56 @@ Your final response should be a number between 1 and 10.
 If you are hesitant in answering, you can also provide a caveat to your response (Optional).
 """
 
+# ------------------------------------------------------------------------------
+# BATCHED SURVEY
+# Alternative survey mode that asks every WVS question in a single structured
+# output call instead of one request per question. The response model has one
+# integer field per question id, bounded by that question's scale.
+# ------------------------------------------------------------------------------
+BOT_BATCH_SURVEY_PROMPT: str = """You are a survey taker helping with social science research.
+You will be asked to respond to several questions at once, each on its own numeric scale.
+Answer every question independently with a single number within that question's scale.
+If you are hesitant in answering, you can also provide a caveat to your responses (Optional).
+"""
+
+
+def build_batched_survey_response(questions: list[dict]) -> type[BaseModel]:
+    """
+    Create a response model with one bounded integer field per question id.
+
+    The optional caveat comes after the scores, as in SurveyResponse, so the
+    model commits to its answers before writing any hedge.
+    """
+    fields = {
+        question["id"]: (Annotated[int, Field(ge=question["scale_min"], le=question["scale_max"])], ...)
+        for question in questions
+    }
+    fields["caveat"] = (str | None, None)
+    return create_model("BatchedSurveyResponse", **fields)
+
+
+def format_batched_survey(questions: list[dict]) -> str:
+    """Render the questions as one user message, labelled by their response field."""
+    lines = ["Answer each of the following questions. Use the question id as the field name.", ""]
+    for question in questions:
+        lines.append(f"[{question['id']}] (scale {question['scale_min']}-{question['scale_max']}) {question['text']}")
+    return "\n".join(lines)
+
+
+BatchedSurveyResponse = build_batched_survey_response(WVS_QUESTIONS)
+
+# ------------------------------------------------------------------------------
+# LOGPROB SURVEY
+# Alternative survey mode that reads the probability of every score from the
+# logprobs of the first response token, instead of sampling a single integer.
+# The answer must therefore start with the number itself. Formatted with each
+# question's scale_min and scale_max.
+# ------------------------------------------------------------------------------
+BOT_LOGPROB_SURVEY_PROMPT: str = """You are a survey taker helping with social science research.
+You will be asked to respond to a question on a scale of {scale_min}-{scale_max}.
+Reply with only the number, with no other text before or after it.
+"""
+
 # ------------------------------------------------------------------------------
 # USER LLM SYSTEM PROMPT
 # This LLM is prompted to embody non-WEIRD cultural values.
@@ -259,3 +311,33 @@ Last piece: what do you prioritize when values clash—freedom or security, free
 # "If something doesn't directly harm anyone and everyone 'consents,' is it automatically okay or do you think community duties and sacred boundaries still matter?"
 
 # "When someone says 'it's my choice,' how much should that outweigh the expectations of family and community? When is conformity actually a good thing?"
+
+# ------------------------------------------------------------------------------
+# CONTEXT SUMMARY
+# Used by the "summary" context policy (see context.py) to fold older turns of a
+# long conversation into a running summary. The summary is written from a
+# neutral point of view so that both the bot and the user LLM can be given it.
+# ------------------------------------------------------------------------------
+CONTEXT_SUMMARY_PROMPT: str = """You maintain a running summary of a conversation between "the user" (who opened the conversation) and "the assistant".
+You will be given the current summary (possibly empty) and the next part of the conversation.
+Reply with an updated summary that keeps every position, argument, concession and change of mind of both sides, in the order they happened.
+Write in neutral third person. Do not add commentary or evaluate the arguments.
+"""
+
+# Shown to each LLM in place of the summarised turns; {role} is "user" or "assistant"
+CONTEXT_SUMMARY_NOTE: str = """Summary of the earlier part of this conversation (you are "the {role}" in it):
+{summary}"""
+
+# ------------------------------------------------------------------------------
+# SWEEP VARIANTS
+# Named user personas and conversation topics that a sweep spec (see sweep.py)
+# can refer to. Add entries here to compare conditions without editing the
+# defaults above.
+# ------------------------------------------------------------------------------
+PERSONAS: dict[str, str] = {
+    "non_weird": USER_SYSTEM_PROMPT,
+}
+
+TOPICS: dict[str, str] = {
+    "society": CONVERSATION_TOPIC,
+}
@@ -0,0 +1,541 @@
+"""
+Parallel multi-trial runner for the WEIRD bias drift experiment.
+
+Runs many trials at once on a shared AsyncOpenAI client, keeping request and
+token throughput under the account's per-minute limits, retrying rate-limited
+and transient failures with exponential backoff, and failing only the affected
+trial when something goes wrong.
+
+Usage from a notebook:
+    outcome = await run_trials(100, concurrency=30, rpm=500, tpm=30_000)
+
+Usage from the command line:
+    python runner.py --trials 100 --concurrency 30 --rpm 500 --tpm 30000
+    python runner.py --trials 1000 --concurrency 200 --backend fake --results-dir /tmp/sim
+
+With --checkpoint, every step of every trial is streamed to an append-only
+log; --resume finishes the partial trials in that log before starting new ones.
+With --store, finished trials are also appended to a columnar ResultsStore
+(see store.py); add --no-json to skip the per-trial JSON files.
+
+With --target-half-width, --trials becomes a budget: the runner tracks an
+anytime-valid confidence sequence of every question's mean drift (see
+sequential.py) and stops starting new trials once all of them (or the
+--stop-questions subset) are narrower than the target.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+import openai
+from openai import AsyncOpenAI
+
+from backends import BACKENDS, Namespace, create_backend
+from cache import AsyncCachedClient, DiskCache
+from checkpoint import CheckpointLog, count_missing_steps, run_checkpointed_trial, unfinished_trials
+from context import CONTEXT_POLICIES, context_policy as make_context_policy
+from experiment import SURVEY_MODES, run_experiment_async
+from sequential import CS_METHODS, DriftMonitor
+from store import ResultsStore
+from telemetry import note_latency, note_retry, summarize
+
+
+# Completion tokens reserved per request before the real usage is known
+EXPECTED_COMPLETION_TOKENS = 256
+
+# Default bucket capacity, in seconds of refill. Providers enforce per-minute
+# limits over shorter windows, so a full minute's burst at startup gets 429s.
+BURST_SECONDS = 5.0
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` units per minute.
+
+    The balance may go negative when a request turns out to cost more than was
+    reserved for it; later acquires then wait until the debt is repaid.
+
+    Args:
+        per_minute: Refill rate
+        capacity: Largest burst (default: BURST_SECONDS of refill, at least 1)
+    """
+
+    def __init__(self, per_minute: float, capacity: float | None = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(self.rate * BURST_SECONDS, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float) -> None:
+        """Wait until `amount` units are available, then take them."""
+        # More than the bucket can hold waits for a full bucket and goes into debt
+        needed = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        """Charge (positive) or refund (negative) units after the fact."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """
+    Shared request/token budget plus retry policy for all in-flight trials.
+
+    Args:
+        rpm: Requests per minute (None for no limit)
+        tpm: Tokens per minute (None for no limit)
+        max_retries: Retries per request before the error is raised
+        base_delay: First backoff delay in seconds (doubled on each retry)
+        max_delay: Upper bound on a single backoff delay in seconds
+        burst_seconds: Bucket capacity in seconds of refill, i.e. how far
+            ahead of the steady rate a burst may run
+    """
+
+    def __init__(
+        self,
+        rpm: float | None = None,
+        tpm: float | None = None,
+        max_retries: int = 8,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        burst_seconds: float = BURST_SECONDS,
+    ):
+        self.requests = TokenBucket(rpm, max(rpm / 60 * burst_seconds, 1.0)) if rpm else None
+        self.tokens = TokenBucket(tpm, tpm / 60 * burst_seconds) if tpm else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # When the server says "slow down", every caller backs off, not just one
+        self._paused_until = 0.0
+
+    async def call(self, fn, **kwargs):
+        """Call `fn(**kwargs)` within the budget, retrying retryable errors."""
+        estimate = _estimate_tokens(kwargs.get("messages", []))
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_pause()
+            if self.requests:
+                await self.requests.acquire(1)
+            if self.tokens:
+                await self.tokens.acquire(estimate)
+            started = time.perf_counter()
+            try:
+                response = await fn(**kwargs)
+            except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+                if attempt == self.max_retries:
+                    raise
+                note_retry()
+                delay = self._retry_delay(attempt, e)
+                if isinstance(e, openai.RateLimitError):
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                print(f"{type(e).__name__}; retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+                await asyncio.sleep(delay)
+                continue
+            note_latency(time.perf_counter() - started)
+            usage = getattr(response, "usage", None)
+            if self.tokens and usage is not None:
+                self.tokens.adjust(usage.total_tokens - estimate)
+            return response
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        """Exponential backoff with full jitter, deferring to Retry-After if sent."""
+        retry_after = _retry_after_seconds(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay) + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def _wait_for_pause(self) -> None:
+        while (remaining := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(remaining)
+
+
+class PerModelRateLimiter:
+    """
+    A separate RateLimiter per model, since providers enforce limits per model.
+
+    Requests for one model then never wait on another model's budget, so a
+    sweep mixing models can keep every model's limit saturated.
+
+    Args:
+        limits: {model: (rpm, tpm)} for models with their own limits
+        rpm: Requests per minute for any other model (None for no limit)
+        tpm: Tokens per minute for any other model (None for no limit)
+        **options: max_retries, base_delay, max_delay, burst_seconds (see RateLimiter)
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, tuple[float | None, float | None]] | None = None,
+        rpm: float | None = None,
+        tpm: float | None = None,
+        **options,
+    ):
+        self.limits = dict(limits or {})
+        self.default = (rpm, tpm)
+        self.options = options
+        self.limiters: dict[str, RateLimiter] = {}
+
+    async def call(self, fn, **kwargs):
+        model = kwargs["model"]
+        if model not in self.limiters:
+            rpm, tpm = self.limits.get(model, self.default)
+            self.limiters[model] = RateLimiter(rpm=rpm, tpm=tpm, **self.options)
+        return await self.limiters[model].call(fn, **kwargs)
+
+
+class RateLimitedClient:
+    """
+    Stand-in for AsyncOpenAI whose chat calls go through a RateLimiter.
+
+    Only the two endpoints the experiment uses are exposed:
+    `chat.completions.create` and `beta.chat.completions.parse`.
+    """
+
+    def __init__(self, client: AsyncOpenAI, limiter: RateLimiter | PerModelRateLimiter):
+        self.chat = Namespace(completions=Namespace(
+            create=lambda **kw: limiter.call(client.chat.completions.create, **kw),
+        ))
+        self.beta = Namespace(chat=Namespace(completions=Namespace(
+            parse=lambda **kw: limiter.call(client.beta.chat.completions.parse, **kw),
+        )))
+
+
+def _estimate_tokens(messages: list[dict]) -> int:
+    """Rough prompt size (~4 characters per token) plus the completion allowance."""
+    chars = sum(len(m.get("content") or "") for m in messages)
+    return chars // 4 + 4 * len(messages) + EXPECTED_COMPLETION_TOKENS
+
+
+def _retry_after_seconds(error: Exception) -> float | None:
+    """Read Retry-After (or OpenAI's retry-after-ms) from an API error, if present."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+def save_result(result: dict, results_dir: str = "results") -> str:
+    """
+    Write a trial result to results/result_<ms>.json and return the path.
+
+    A result without a "trial_id" gets the file name (result_<ms>) as its
+    trial_id, so a ResultsStore it is also appended to uses the same id and
+    store.migrate_json_results does not import it a second time.
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    # Millisecond timestamps can collide when trials finish together
+    stamp = int(time.time() * 1000)
+    while os.path.exists(filename := os.path.join(results_dir, f"result_{stamp}.json")):
+        stamp += 1
+    result.setdefault("trial_id", f"result_{stamp}")
+    with open(filename, "w") as f:
+        json.dump(result, f, indent=2)
+    return filename
+
+
+async def run_trials(
+    n: int,
+    concurrency: int = 20,
+    rpm: float | None = None,
+    tpm: float | None = None,
+    bot_model: str = "gpt-4o",
+    user_model: str = "gpt-4o",
+    n_turns: int = 10,
+    api_key: str | None = None,
+    client: AsyncOpenAI | None = None,
+    results_dir: str | None = "results",
+    max_retries: int = 8,
+    burst_seconds: float = BURST_SECONDS,
+    checkpoint_path: str | None = None,
+    resume: bool = False,
+    cache_dir: str | None = None,
+    cache_mode: str = "read_through",
+    survey_mode: str = "per_question",
+    measure_every: int | None = None,
+    context_policy: dict | None = None,
+    store_dir: str | None = None,
+    store_flush_every: int = 50,
+    target_half_width: float | None = None,
+    stop_questions: list[str] | None = None,
+    alpha: float = 0.05,
+    cs_method: str = "bernstein",
+    min_trials: int = 10,
+) -> dict:
+    """
+    Run `n` independent trials with up to `concurrency` in flight at once.
+
+    Args:
+        n: Number of new trials
+        concurrency: Maximum number of trials running at the same time
+        rpm: Requests-per-minute limit shared by all trials (None for no limit)
+        tpm: Tokens-per-minute limit shared by all trials (None for no limit)
+        bot_model: Model for the bot LLM (the one we measure for drift)
+        user_model: Model for the user LLM (prompted with non-WEIRD values)
+        n_turns: Number of conversation turns per trial
+        api_key: OpenAI API key (defaults to OPENAI_API_KEY)
+        client: Pre-built async client; overrides api_key
+        results_dir: Directory to save each finished trial to (None to skip saving)
+        max_retries: Retries per request on rate-limit/transient errors
+        burst_seconds: How many seconds of rpm/tpm budget may be spent at once
+        checkpoint_path: JSONL log to stream every trial step to (None to disable)
+        resume: Also finish the unfinished trials found in checkpoint_path,
+            each restarting at its first missing step
+        cache_dir: Directory of a DiskCache for all responses (None to disable);
+            trial i reuses trial i's cached responses on a re-run
+        cache_mode: "read_through", "record" or "replay" (see cache.py)
+        survey_mode: "per_question", "batched" or "logprobs" (see experiment.measure_wvs)
+        measure_every: Fork a survey every this many turns to record a drift
+            trajectory (see experiment.run_conversation)
+        context_policy: Context policy from context.context_policy (None sends
+            the full history; see experiment.run_experiment)
+        store_dir: Directory of a ResultsStore to append finished trials to
+            (None to disable); pass results_dir=None to skip the JSON files
+        store_flush_every: Finished trials buffered per store segment
+        target_half_width: Stop starting new trials once every question's
+            drift confidence sequence is at most this wide on each side
+            (None runs all `n` trials); trials already in flight and
+            resumed partial trials still finish
+        stop_questions: Question ids the stopping rule looks at (default: all)
+        alpha: Miscoverage of each question's confidence sequence
+        cs_method: "bernstein" or "asymptotic" (see sequential.py)
+        min_trials: Finished trials required before stopping early
+
+    Returns:
+        Dict with "results" (finished trial dicts, in completion order) and
+        "failures" ({"trial": index, "error": message} for each failed trial);
+        with target_half_width also "sequential" (final per-question
+        intervals) and "stopped_early"
+    """
+    if resume and checkpoint_path is None:
+        raise ValueError("resume=True requires a checkpoint_path")
+    if client is None:
+        # Retries are handled by the RateLimiter so that they share its budget
+        client = AsyncOpenAI(api_key=api_key, max_retries=0)
+    limiter = RateLimiter(rpm=rpm, tpm=tpm, max_retries=max_retries, burst_seconds=burst_seconds)
+    limited_client = RateLimitedClient(client, limiter)
+    semaphore = asyncio.Semaphore(concurrency)
+    cache = DiskCache(cache_dir) if cache_dir is not None else None
+    store = ResultsStore(store_dir) if store_dir is not None else None
+    monitor = None
+    if target_half_width is not None:
+        monitor = DriftMonitor(alpha=alpha, method=cs_method, min_trials=min_trials, planned_trials=n)
+        unknown = set(stop_questions or ()) - set(monitor.sequences)
+        if unknown:
+            raise ValueError(f"Unknown stop_questions: {sorted(unknown)}")
+    stopped = asyncio.Event()
+    config = {
+        "bot_model": bot_model,
+        "user_model": user_model,
+        "n_turns": n_turns,
+        "survey_mode": survey_mode,
+        "measure_every": measure_every,
+        "context_policy": context_policy,
+    }
+
+    pending = unfinished_trials(checkpoint_path) if resume else {}
+    if pending:
+        steps = sum(count_missing_steps(trial) for trial in pending.values())
+        print(f"Resuming {len(pending)} partial trials ({steps} calls left)")
+    log = CheckpointLog(checkpoint_path) if checkpoint_path is not None else None
+    total = n + len(pending)
+
+    results = []
+    failures = []
+    unstored = []
+
+    def flush_store() -> None:
+        if store is not None and unstored:
+            store.append(unstored)
+            unstored.clear()
+
+    async def trial(index, trial_id: str | None = None, state: dict | None = None) -> None:
+        trial_client = limited_client
+        if cache is not None:
+            # Cache hits skip the rate limiter entirely
+            trial_client = AsyncCachedClient(limited_client, cache, cache_mode, sample=index)
+        async with semaphore:
+            # Resumed trials always finish, so none is left unfinished in the checkpoint log
+            if stopped.is_set() and state is None:
+                return
+            try:
+                if log is None:
+                    result = await run_experiment_async(
+                        bot_model=bot_model,
+                        user_model=user_model,
+                        n_turns=n_turns,
+                        client=trial_client,
+                        survey_mode=survey_mode,
+                        measure_every=measure_every,
+                        context_policy=context_policy,
+                    )
+                else:
+                    result = await run_checkpointed_trial(
+                        trial_client,
+                        log,
+                        state["config"] if state else config,
+                        trial_id=trial_id,
+                        state=state,
+                    )
+            except Exception as e:
+                print(f"Trial {index} failed: {e!r}")
+                failures.append({"trial": index, "error": repr(e)})
+                return
+        filename = save_result(result, results_dir) if results_dir is not None else None
+        if log is not None:
+            log.append(result["trial_id"], "done", result_file=filename)
+        results.append(result)
+        unstored.append(result)
+        if len(unstored) >= store_flush_every:
+            flush_store()
+        print(f"Trial {index} finished ({len(results)}/{total} done, {len(failures)} failed)")
+        if monitor is not None:
+            monitor.update(result)
+            if not stopped.is_set() and monitor.should_stop(target_half_width, stop_questions):
+                widest = max(monitor.half_widths()[q] for q in stop_questions or monitor.sequences)
+                print(f"Target half-width reached after {monitor.trials} trials (widest {widest:.3f}); stopping")
+                stopped.set()
+
+    try:
+        await asyncio.gather(
+            *(trial(trial_id, trial_id, state) for trial_id, state in pending.items()),
+            *(trial(i) for i in range(n)),
+        )
+    finally:
+        flush_store()
+        if store is not None:
+            store.compact()
+        if log is not None:
+            log.close()
+    outcome = {"results": results, "failures": failures}
+    if monitor is not None:
+        outcome["sequential"] = monitor.summary()
+        outcome["stopped_early"] = stopped.is_set()
+    return outcome
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run WEIRD bias drift trials in parallel.")
+    parser.add_argument("--trials", type=int, default=100, help="Number of trials to run")
+    parser.add_argument("--concurrency", type=int, default=20, help="Trials in flight at once")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests-per-minute limit")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens-per-minute limit")
+    parser.add_argument("--bot-model", default="gpt-4o")
+    parser.add_argument("--user-model", default="gpt-4o")
+    parser.add_argument("--n-turns", type=int, default=10)
+    parser.add_argument("--results-dir", default="results")
+    parser.add_argument("--store", default=None, help="Columnar results store to append trials to")
+    parser.add_argument("--no-json", action="store_true", help="Do not write result_*.json files (use with --store)")
+    parser.add_argument("--max-retries", type=int, default=8)
+    parser.add_argument("--burst-seconds", type=float, default=BURST_SECONDS,
+                        help="Seconds of --rpm/--tpm budget that may be spent in one burst")
+    parser.add_argument("--survey-mode", default="per_question", choices=SURVEY_MODES)
+    parser.add_argument("--measure-every", type=int, default=None, help="Measure every k turns for a drift trajectory")
+    parser.add_argument("--context-policy", default="full", choices=CONTEXT_POLICIES,
+                        help="How much of a long conversation each call sees (see context.py)")
+    parser.add_argument("--context-max-tokens", type=int, default=None, help="Token budget for --context-policy window")
+    parser.add_argument("--context-recent", type=int, default=None,
+                        help="Recent messages kept verbatim for --context-policy pinned/summary")
+    parser.add_argument("--summarize-every", type=int, default=None, help="Messages folded into each summary update")
+    parser.add_argument("--summary-model", default=None, help="Model writing summaries for --context-policy summary")
+    parser.add_argument("--checkpoint", default=None, help="JSONL log to stream trial steps to")
+    parser.add_argument("--cache-dir", default=None, help="Directory for the on-disk response cache")
+    parser.add_argument("--cache-mode", default="read_through", choices=["read_through", "record", "replay"])
+    parser.add_argument("--resume", action="store_true", help="Finish partial trials from --checkpoint first")
+    parser.add_argument("--target-half-width", type=float, default=None,
+                        help="Stop early once every drift CI half-width is below this")
+    parser.add_argument("--stop-questions", default=None, help="Comma-separated question ids for the stopping rule")
+    parser.add_argument("--alpha", type=float, default=0.05, help="Miscoverage of the stopping confidence sequences")
+    parser.add_argument("--cs-method", default="bernstein", choices=CS_METHODS)
+    parser.add_argument("--min-trials", type=int, default=10, help="Trials before stopping early is allowed")
+    parser.add_argument("--backend", default="openai", choices=BACKENDS)
+    parser.add_argument("--base-url", default=None, help="OpenAI-compatible server URL (--backend local)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for --backend fake")
+    parser.add_argument("--fake-latency", type=float, default=0.5, help="Mean call latency for --backend fake")
+    args = parser.parse_args()
+
+    if args.backend == "fake":
+        client = create_backend(
+            "fake", asynchronous=True, seed=args.seed, latency=args.fake_latency, latency_sigma=0.5
+        )
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+        # Retries are handled by the RateLimiter so that they share its budget
+        client = create_backend(
+            args.backend,
+            asynchronous=True,
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            base_url=args.base_url,
+            max_retries=0,
+        )
+
+    outcome = asyncio.run(run_trials(
+        args.trials,
+        concurrency=args.concurrency,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        bot_model=args.bot_model,
+        user_model=args.user_model,
+        n_turns=args.n_turns,
+        client=client,
+        results_dir=None if args.no_json else args.results_dir,
+        max_retries=args.max_retries,
+        burst_seconds=args.burst_seconds,
+        checkpoint_path=args.checkpoint,
+        resume=args.resume,
+        cache_dir=args.cache_dir,
+        cache_mode=args.cache_mode,
+        survey_mode=args.survey_mode,
+        measure_every=args.measure_every,
+        context_policy=make_context_policy(
+            args.context_policy,
+            max_tokens=args.context_max_tokens,
+            recent_messages=args.context_recent,
+            summarize_every=args.summarize_every,
+            summary_model=args.summary_model,
+        ),
+        store_dir=args.store,
+        target_half_width=args.target_half_width,
+        stop_questions=args.stop_questions.split(",") if args.stop_questions else None,
+        alpha=args.alpha,
+        cs_method=args.cs_method,
+        min_trials=args.min_trials,
+    ))
+    print(f"{len(outcome['results'])} trials finished, {len(outcome['failures'])} failed")
+    overall = summarize(outcome["results"])["overall"]
+    print(
+        f"latency p50/p95: {overall['latency_p50_s']}/{overall['latency_p95_s']} s, "
+        f"rate-limit wait p50/p95: {overall['wait_p50_s']}/{overall['wait_p95_s']} s, "
+        f"{overall['prompt_tokens_per_trial']:.0f} prompt tokens/trial, "
+        f"${overall['cost_per_trial_usd']:.4f}/trial"
+    )
+    for failure in outcome["failures"]:
+        print(f"  trial {failure['trial']}: {failure['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Anytime-valid confidence sequences for adaptive stopping of trial sweeps.
+
+Looking at ordinary bootstrap or t intervals after every trial and stopping
+once they are narrow enough ("peeking") inflates the error rate far beyond
+alpha. A confidence sequence instead holds simultaneously for every number of
+trials, so it may be checked after each trial and the sweep stopped at any
+time without invalidating the interval.
+
+Two confidence sequences are available, both updated in O(1) per trial:
+
+    "bernstein"   Predictable plug-in empirical Bernstein CS (Waudby-Smith &
+                  Ramdas, 2023). Valid at every sample size for bounded data;
+                  the bound is the question's scale range, so it is
+                  conservative when drift is rare but large.
+    "asymptotic"  Asymptotic CS from a Gaussian mixture with a plug-in
+                  variance (Waudby-Smith et al., 2024). Much tighter; valid as
+                  the number of trials grows, so no interval is formed before
+                  min_trials trials (small-sample variance estimates would
+                  otherwise poison the running intersection).
+
+Each interval is the running intersection of all intervals so far, which
+keeps the coverage guarantee and makes half-widths non-increasing.
+"""
+
+import math
+
+from prompts import WVS_QUESTIONS
+
+
+CS_METHODS = ("bernstein", "asymptotic")
+
+
+class _QuestionSequence:
+    """Confidence sequence for the mean drift of one question."""
+
+    def __init__(self, low: float, high: float, alpha: float, method: str, planned_trials: int, burn_in: int):
+        self.low, self.high = low, high
+        self.alpha = alpha
+        self.method = method
+        self.burn_in = max(burn_in, 2)
+        self.n = 0
+        # Welford running mean and sum of squared deviations of the raw drift
+        self.mean = 0.0
+        self.m2 = 0.0
+        # Empirical Bernstein state, on drift rescaled to [0, 1]
+        self.scaled_mean = 0.5
+        self.scaled_variance = 0.25
+        self.scaled_squares = 0.0
+        self.scaled_sum = 0.0
+        self.lambda_sum = 0.0
+        self.weighted_sum = 0.0
+        self.penalty = 0.0
+        # Mixture width chosen to be tightest around the planned number of trials
+        log_alpha = -2 * math.log(alpha)
+        self.rho2 = (log_alpha + math.log(log_alpha + 1)) / max(planned_trials, 1)
+        self.interval = (low, high)
+
+    def update(self, drift: float) -> None:
+        self.n += 1
+        delta = drift - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (drift - self.mean)
+
+        x = (drift - self.low) / (self.high - self.low)
+        log_term = math.log(2 / self.alpha)
+        lam = min(math.sqrt(2 * log_term / (self.scaled_variance * self.n * math.log(1 + self.n))), 0.5)
+        # v_t * psi_E(lambda_t) with v_t = 4 (x - mean)^2 and psi_E(l) = (-log(1 - l) - l) / 4
+        self.penalty += (x - self.scaled_mean) ** 2 * (-math.log(1 - lam) - lam)
+        self.lambda_sum += lam
+        self.weighted_sum += lam * x
+        # Predictable estimates for the next step only use data seen so far
+        self.scaled_sum += x
+        self.scaled_mean = (0.5 + self.scaled_sum) / (self.n + 1)
+        self.scaled_squares += (x - self.scaled_mean) ** 2
+        self.scaled_variance = (0.25 + self.scaled_squares) / (self.n + 1)
+
+        low, high = self._current()
+        self.interval = (max(self.interval[0], low), min(self.interval[1], high))
+
+    def _current(self) -> tuple[float, float]:
+        if self.method == "bernstein":
+            span = self.high - self.low
+            center = self.weighted_sum / self.lambda_sum
+            width = (math.log(2 / self.alpha) + self.penalty) / self.lambda_sum
+            return self.low + (center - width) * span, self.low + (center + width) * span
+        if self.n < self.burn_in:
+            return self.low, self.high
+        sd = math.sqrt(self.m2 / (self.n - 1))
+        t_rho2 = self.n * self.rho2
+        width = sd * math.sqrt(2 * (t_rho2 + 1) / (self.n * t_rho2) * math.log(math.sqrt(t_rho2 + 1) / self.alpha))
+        return self.mean - width, self.mean + width
+
+    @property
+    def half_width(self) -> float:
+        low, high = self.interval
+        # Running intersections can cross when the data contradict earlier intervals
+        return max(high - low, 0.0) / 2
+
+
+class DriftMonitor:
+    """
+    Per-question confidence sequences for mean drift, updated as trials land.
+
+    Args:
+        alpha: Miscoverage of each question's confidence sequence
+        method: "bernstein" or "asymptotic" (see module docstring)
+        min_trials: Trials required before should_stop can return True
+        planned_trials: Sample size the asymptotic CS is tuned to be tightest at
+        questions: Question dicts with "id", "scale_min" and "scale_max"
+    """
+
+    def __init__(
+        self,
+        alpha: float = 0.05,
+        method: str = "bernstein",
+        min_trials: int = 10,
+        planned_trials: int = 100,
+        questions: list[dict] = WVS_QUESTIONS,
+    ):
+        if method not in CS_METHODS:
+            raise ValueError(f"method must be one of {CS_METHODS}, got {method!r}")
+        self.min_trials = min_trials
+        self.trials = 0
+        self.sequences = {}
+        for q in questions:
+            span = q["scale_max"] - q["scale_min"]
+            self.sequences[q["id"]] = _QuestionSequence(-span, span, alpha, method, planned_trials, min_trials)
+
+    def update(self, result: dict) -> None:
+        """Add one finished trial's drift to every question it answered."""
+        self.trials += 1
+        for question_id, sequence in self.sequences.items():
+            if question_id in result["baseline"] and question_id in result["post"]:
+                sequence.update(result["post"][question_id] - result["baseline"][question_id])
+
+    def half_widths(self) -> dict[str, float]:
+        return {question_id: sequence.half_width for question_id, sequence in self.sequences.items()}
+
+    def should_stop(self, target_half_width: float, questions: list[str] | None = None) -> bool:
+        """Whether every question in `questions` (default: all) is within the target half-width."""
+        if self.trials < self.min_trials:
+            return False
+        selected = questions if questions is not None else list(self.sequences)
+        return all(self.sequences[q].half_width <= target_half_width for q in selected)
+
+    def summary(self) -> dict:
+        return {
+            "trials": self.trials,
+            "questions": {
+                question_id: {
+                    "n": sequence.n,
+                    "mean_drift": sequence.mean,
+                    "ci_low": sequence.interval[0],
+                    "ci_high": sequence.interval[1],
+                    "half_width": sequence.half_width,
+                }
+                for question_id, sequence in self.sequences.items()
+            },
+        }
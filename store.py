@@ -0,0 +1,357 @@
+"""
+Compact columnar results store.
+
+Scores are what almost every analysis needs, and conversation text is what
+makes the loose result_*.json files large. The store keeps them apart:
+
+    <store>/manifest.json           - version counter, segment list, configs
+    <store>/segments/seg_<n>.npz     - one columnar segment per append (merged
+                                       once there are more than MAX_SEGMENTS):
+                                       trial_ids, timestamps, config_ids,
+                                       question_ids, baseline, post (float64),
+                                       conversation / extras blob hashes
+    <store>/blobs/<ab>/<hash>.json.gz - gzip JSON blobs, content-addressed so
+                                       identical conversations are stored once
+
+load_scores() only reads the segments, so loading tens of thousands of trials
+never touches conversation text; get_conversation() / get_trial() look a trial
+up lazily through the index. migrate_json_results() imports the existing
+results/result_*.json files.
+
+Usage from the command line:
+    python store.py migrate results/ --store results_store
+    python store.py info --store results_store
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from typing import NamedTuple
+
+import numpy as np
+
+
+# append() merges all segments once there are more than this many, since
+# every segment costs a file open on load
+MAX_SEGMENTS = 16
+
+
+class Scores(NamedTuple):
+    """Score columns of every trial in a store, aligned on question_ids."""
+
+    trial_ids: np.ndarray  # (n_trials,) str
+    timestamps: np.ndarray  # (n_trials,) int64 milliseconds
+    config_ids: np.ndarray  # (n_trials,) int32 index into ResultsStore.configs
+    question_ids: list[str]
+    baseline: np.ndarray  # (n_trials, n_questions) float64, NaN where not asked
+    post: np.ndarray  # (n_trials, n_questions) float64, NaN where not asked
+
+
+def _hash(data) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def _write_json_atomic(path: str, data) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+class ResultsStore:
+    """
+    Columnar store for trial results.
+
+    Args:
+        directory: Store location (created if missing)
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "segments"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        self._manifest_path = os.path.join(directory, "manifest.json")
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path) as f:
+                self._manifest = json.load(f)
+        else:
+            self._manifest = {"version": 0, "segments": [], "configs": []}
+        self._scores_cache = None
+        self._index = None
+
+    @property
+    def version(self) -> int:
+        """Incremented on every write; use it to invalidate derived caches."""
+        return self._manifest["version"]
+
+    @property
+    def configs(self) -> list[dict]:
+        """Distinct trial configs; Scores.config_ids index into this list."""
+        return self._manifest["configs"]
+
+    def config_ids(self, **fields) -> np.ndarray:
+        """
+        Ids of the configs matching every field, e.g. config_ids(cell=name).
+
+        Select the matching trials with np.isin(scores.config_ids, ids).
+        """
+        return np.array(
+            [i for i, config in enumerate(self.configs) if all(config.get(k) == v for k, v in fields.items())],
+            dtype=np.int32,
+        )
+
+    def __len__(self) -> int:
+        return sum(segment["rows"] for segment in self._manifest["segments"])
+
+    # -- blobs -----------------------------------------------------------------
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "blobs", digest[:2], f"{digest}.json.gz")
+
+    def put_blob(self, data) -> str:
+        """Store JSON data once under its content hash and return the hash."""
+        digest = _hash(data)
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        return digest
+
+    def get_blob(self, digest: str):
+        with gzip.open(self._blob_path(digest), "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    # -- writing ---------------------------------------------------------------
+
+    def _config_id(self, config: dict) -> int:
+        if config in self.configs:
+            return self.configs.index(config)
+        self.configs.append(config)
+        return len(self.configs) - 1
+
+    def append(
+        self,
+        results: list[dict],
+        trial_ids: list[str] | None = None,
+        timestamps: list[int] | None = None,
+    ) -> list[str]:
+        """
+        Add trial results as a new segment (compacting once there are
+        more than MAX_SEGMENTS).
+
+        Args:
+            results: Result dicts as returned by run_experiment
+            trial_ids: Ids for the trials (default: result["trial_id"] or a new uuid)
+            timestamps: Millisecond timestamps (default: now)
+
+        Returns:
+            The trial ids written
+        """
+        if not results:
+            return []
+        question_ids = list(dict.fromkeys(q for r in results for q in (*r["baseline"], *r["post"])))
+        column = {q: i for i, q in enumerate(question_ids)}
+        baseline = np.full((len(results), len(question_ids)), np.nan, dtype=np.float64)
+        post = np.full_like(baseline, np.nan)
+        ids, conversation_hashes, extras_hashes, config_ids = [], [], [], []
+        now = int(time.time() * 1000)
+
+        for row, result in enumerate(results):
+            for q, score in result["baseline"].items():
+                baseline[row, column[q]] = score
+            for q, score in result["post"].items():
+                post[row, column[q]] = score
+            trial_id = trial_ids[row] if trial_ids else result.get("trial_id") or uuid.uuid4().hex
+            ids.append(trial_id)
+            config = {k: v for k, v in result["config"].items() if k != "telemetry"}
+            config_ids.append(self._config_id(config))
+            conversation_hashes.append(self.put_blob(result["conversation"]))
+            # Everything else (telemetry, trajectory, distributions, ...) is kept for get_trial
+            extras = {k: v for k, v in result.items() if k not in ("baseline", "post", "conversation", "config", "trial_id")}
+            if "telemetry" in result["config"]:
+                extras["telemetry"] = result["config"]["telemetry"]
+            extras_hashes.append(self.put_blob(extras))
+
+        segment = f"seg_{self.version + 1:06d}.npz"
+        np.savez(
+            os.path.join(self.directory, "segments", segment),
+            trial_ids=np.array(ids),
+            timestamps=np.array(timestamps if timestamps else [now] * len(results), dtype=np.int64),
+            config_ids=np.array(config_ids, dtype=np.int32),
+            question_ids=np.array(question_ids),
+            baseline=baseline,
+            post=post,
+            conversations=np.array(conversation_hashes),
+            extras=np.array(extras_hashes),
+        )
+        self._manifest["segments"].append({"file": segment, "rows": len(results)})
+        self._manifest["version"] += 1
+        _write_json_atomic(self._manifest_path, self._manifest)
+        self._scores_cache = None
+        self._index = None
+        if len(self._manifest["segments"]) > MAX_SEGMENTS:
+            self.compact()
+        return ids
+
+    def compact(self) -> None:
+        """Merge all segments into one (fewer files to open on load)."""
+        if len(self._manifest["segments"]) <= 1:
+            return
+        arrays = self._load_segments(("conversations", "extras"))
+        old_segments = self._manifest["segments"]
+        segment = f"seg_{self.version + 1:06d}.npz"
+        np.savez(os.path.join(self.directory, "segments", segment), **arrays)
+        self._manifest["segments"] = [{"file": segment, "rows": len(arrays["trial_ids"])}]
+        self._manifest["version"] += 1
+        _write_json_atomic(self._manifest_path, self._manifest)
+        for old in old_segments:
+            os.remove(os.path.join(self.directory, "segments", old["file"]))
+        self._scores_cache = None
+        self._index = None
+
+    # -- reading ---------------------------------------------------------------
+
+    def _load_segments(self, extra_columns: tuple[str, ...] = ()) -> dict[str, np.ndarray]:
+        """Concatenate all segments, aligning score columns on the union of questions."""
+        segments = []
+        for segment in self._manifest["segments"]:
+            with np.load(os.path.join(self.directory, "segments", segment["file"])) as data:
+                segments.append({name: data[name] for name in data.files})
+        question_ids = list(dict.fromkeys(q for s in segments for q in s["question_ids"].tolist()))
+        column = {q: i for i, q in enumerate(question_ids)}
+        n_rows = sum(len(s["trial_ids"]) for s in segments)
+        baseline = np.full((n_rows, len(question_ids)), np.nan, dtype=np.float64)
+        post = np.full_like(baseline, np.nan)
+        row = 0
+        for s in segments:
+            columns = [column[q] for q in s["question_ids"].tolist()]
+            baseline[row:row + len(s["trial_ids"]), columns] = s["baseline"]
+            post[row:row + len(s["trial_ids"]), columns] = s["post"]
+            row += len(s["trial_ids"])
+
+        def concat(name: str, dtype) -> np.ndarray:
+            if not segments:
+                return np.array([], dtype=dtype)
+            return np.concatenate([s[name] for s in segments])
+
+        arrays = {
+            "trial_ids": concat("trial_ids", str),
+            "timestamps": concat("timestamps", np.int64),
+            "config_ids": concat("config_ids", np.int32),
+            "question_ids": np.array(question_ids),
+            "baseline": baseline,
+            "post": post,
+        }
+        for name in extra_columns:
+            arrays[name] = concat(name, str)
+        return arrays
+
+    def load_scores(self) -> Scores:
+        """Load the score columns of every trial (cached until the next write)."""
+        if self._scores_cache is None:
+            arrays = self._load_segments()
+            self._scores_cache = Scores(
+                trial_ids=arrays["trial_ids"],
+                timestamps=arrays["timestamps"],
+                config_ids=arrays["config_ids"],
+                question_ids=arrays["question_ids"].tolist(),
+                baseline=arrays["baseline"],
+                post=arrays["post"],
+            )
+        return self._scores_cache
+
+    def _lookup(self, trial_id: str) -> tuple[str, str]:
+        if self._index is None:
+            arrays = self._load_segments(("conversations", "extras"))
+            self._index = {
+                trial: (conversation, extras)
+                for trial, conversation, extras in zip(
+                    arrays["trial_ids"].tolist(), arrays["conversations"].tolist(), arrays["extras"].tolist()
+                )
+            }
+        return self._index[trial_id]
+
+    def get_conversation(self, trial_id: str) -> list[dict]:
+        """Conversation of one trial, read from the blob store on demand."""
+        return self.get_blob(self._lookup(trial_id)[0])
+
+    def get_trial(self, trial_id: str) -> dict:
+        """Reassemble one trial in the run_experiment result format."""
+        scores = self.load_scores()
+        row = int(np.flatnonzero(scores.trial_ids == trial_id)[0])
+
+        def as_dict(values: np.ndarray) -> dict[str, float]:
+            return {q: float(v) for q, v in zip(scores.question_ids, values) if not np.isnan(v)}
+
+        extras = self.get_blob(self._lookup(trial_id)[1])
+        config = dict(self.configs[scores.config_ids[row]])
+        if "telemetry" in extras:
+            config["telemetry"] = extras.pop("telemetry")
+        return {
+            "trial_id": trial_id,
+            "baseline": as_dict(scores.baseline[row]),
+            "post": as_dict(scores.post[row]),
+            "conversation": self.get_conversation(trial_id),
+            "config": config,
+            **extras,
+        }
+
+
+def migrate_json_results(results_dir: str, store: ResultsStore) -> int:
+    """
+    Import results/result_<ms>.json files into a store, skipping ones already imported.
+
+    The trial id of a migrated file is its "trial_id" field (set by
+    runner.save_result, so trials a runner also appended to the store are
+    recognised) or, for older files, its file name without extension. Its
+    timestamp comes from the <ms> part of the name.
+
+    Returns:
+        Number of trials imported
+    """
+    existing = set(store.load_scores().trial_ids.tolist())
+    results, trial_ids, timestamps = [], [], []
+    for filename in sorted(os.listdir(results_dir)):
+        match = re.fullmatch(r"result_(\d+)\.json", filename)
+        if not match or filename[:-5] in existing:
+            continue
+        with open(os.path.join(results_dir, filename)) as f:
+            result = json.load(f)
+        trial_id = result.get("trial_id") or filename[:-5]
+        if trial_id in existing:
+            continue
+        existing.add(trial_id)
+        results.append(result)
+        trial_ids.append(trial_id)
+        timestamps.append(int(match.group(1)))
+    store.append(results, trial_ids=trial_ids, timestamps=timestamps)
+    return len(results)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage the columnar results store.")
+    parser.add_argument("command", choices=["migrate", "compact", "info"])
+    parser.add_argument("results_dir", nargs="?", default="results", help="Directory of result_*.json (migrate)")
+    parser.add_argument("--store", default="results_store")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    if args.command == "migrate":
+        print(f"Imported {migrate_json_results(args.results_dir, store)} trials into {args.store}")
+    elif args.command == "compact":
+        store.compact()
+    scores = store.load_scores()
+    print(f"{len(scores.trial_ids)} trials, {len(scores.question_ids)} questions, "
+          f"{len(store.configs)} configs, {len(store._manifest['segments'])} segments, version {store.version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+"""
+Declarative multi-condition sweeps with shared-work deduplication.
+
+A sweep spec is a grid over bot_model, user_model, persona, topic and n_turns,
+with the same number of trials in every cell:
+
+    {
+        "name": "models_x_turns",
+        "bot_model": ["gpt-4o", "gpt-4o-mini"],
+        "user_model": "gpt-4o",
+        "persona": ["non_weird"],            # names in prompts.PERSONAS, or {"name": "prompt"}
+        "topic": "society",                  # names in prompts.TOPICS, or {"name": "topic"}
+        "n_turns": [5, 10, 20],
+        "trials": 50,
+        "survey_mode": "per_question",       # optional, shared by every cell
+        "context_policy": {"kind": "window", "max_tokens": 8000}   # optional
+    }
+
+The scheduler runs shared work once:
+
+- A baseline survey only depends on bot_model (and BOT_SURVEY_PROMPT), so
+  trial j of every cell with the same bot_model uses the same baseline j.
+- A conversation with fewer turns is a prefix of a longer one with the same
+  models, persona and topic, so trial j of those cells shares one conversation
+  of the longest n_turns; the post survey of each shorter cell is forked off
+  the conversation as soon as its last turn lands.
+
+Work units are queued round-robin across cells (trial 0 of every cell, then
+trial 1, ...) behind one concurrency limit, and each model gets its own rate
+limiter, so every provider limit stays busy instead of cells running one after
+another. Every result's config is tagged with "sweep" and "cell" (plus the
+persona and topic names), and result["shared"] names the baseline and
+conversation it was built from. Each shared call's telemetry is attributed to
+exactly one result, so summing telemetry over a sweep gives its real cost.
+
+Because of the sharing, results of different cells are paired, not
+independent samples: analysis.permutation_test does not apply between cells.
+Pair trials on result["shared"]["baseline"] and use analysis.sign_flip_test
+on the differences of their drifts.
+
+Usage from the command line:
+    python sweep.py sweep.json --concurrency 50 --rpm 500 --store results_store
+    python sweep.py sweep.json --backend fake --results-dir /tmp/sweep
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+
+from openai import AsyncOpenAI
+
+from backends import BACKENDS, create_backend
+from context import ContextCompactor, context_policy as make_context_policy
+from experiment import (
+    check_survey_mode,
+    compact_history_async,
+    experiment_result,
+    measure_wvs_async,
+    run_conversation_async,
+)
+from prompts import PERSONAS, TOPICS, WVS_QUESTIONS
+from runner import PerModelRateLimiter, RateLimitedClient, save_result
+from store import ResultsStore
+from telemetry import Telemetry, summarize
+
+
+SWEEP_AXES = ("bot_model", "user_model", "persona", "topic", "n_turns")
+_CONVERSATION_STAGES = ("opener", "bot_turn", "user_turn")
+
+
+def _as_list(value) -> list:
+    return value if isinstance(value, list) else [value]
+
+
+def _variants(value, registry: dict[str, str], axis: str) -> dict[str, str]:
+    """Named prompt variants: a {name: text} dict, or names looked up in `registry`."""
+    if isinstance(value, dict):
+        return value
+    unknown = [name for name in _as_list(value) if name not in registry]
+    if unknown:
+        raise ValueError(f"Unknown {axis} {unknown}; define it in prompts.py or pass {{name: text}}")
+    return {name: registry[name] for name in _as_list(value)}
+
+
+def expand_grid(spec: dict) -> list[dict]:
+    """
+    List the cells of a sweep spec.
+
+    Returns:
+        One dict per cell: "cell" (its name), the SWEEP_AXES values (persona
+        and topic as names) and "trials"
+    """
+    personas = _variants(spec.get("persona", "non_weird"), PERSONAS, "persona")
+    topics = _variants(spec.get("topic", "society"), TOPICS, "topic")
+    cells = []
+    for bot_model, user_model, persona, topic, n_turns in itertools.product(
+        _as_list(spec.get("bot_model", "gpt-4o")),
+        _as_list(spec.get("user_model", "gpt-4o")),
+        personas,
+        topics,
+        _as_list(spec.get("n_turns", 10)),
+    ):
+        cells.append({
+            "cell": f"bot={bot_model},user={user_model},persona={persona},topic={topic},n_turns={n_turns}",
+            "bot_model": bot_model,
+            "user_model": user_model,
+            "persona": persona,
+            "topic": topic,
+            "n_turns": n_turns,
+            "trials": spec.get("trials", 10),
+        })
+    return cells
+
+
+def _group(cell: dict) -> tuple:
+    """Cells with the same group share their conversations."""
+    return cell["bot_model"], cell["user_model"], cell["persona"], cell["topic"]
+
+
+def plan_sweep(cells: list[dict], survey_mode: str = "per_question") -> dict:
+    """
+    The shared work units of a sweep and the calls they save.
+
+    Returns:
+        Dict with "baselines" ({bot_model: trials}), "conversations"
+        ({group: sorted n_turns}), and "calls" / "calls_without_sharing":
+        API calls needed with and without sharing (excluding retries,
+        logprob fallbacks and context summaries)
+    """
+    survey_calls = 1 if survey_mode == "batched" else len(WVS_QUESTIONS)
+    baselines, conversations = {}, {}
+    for cell in cells:
+        baselines[cell["bot_model"]] = max(baselines.get(cell["bot_model"], 0), cell["trials"])
+        conversations.setdefault(_group(cell), set()).add(cell["n_turns"])
+    trials = {_group(cell): cell["trials"] for cell in cells}
+    unshared = sum(cell["trials"] * (2 * survey_calls + 1 + 2 * cell["n_turns"]) for cell in cells)
+    shared = (
+        sum(n * survey_calls for n in baselines.values())
+        + sum(trials[group] * (1 + 2 * max(turns)) for group, turns in conversations.items())
+        + sum(cell["trials"] * survey_calls for cell in cells)
+    )
+    return {
+        "baselines": baselines,
+        "conversations": {group: sorted(turns) for group, turns in conversations.items()},
+        "calls": shared,
+        "calls_without_sharing": unshared,
+    }
+
+
+def _split_conversation_calls(calls: list[dict], turn_counts: list[int]) -> dict[int, list[dict]]:
+    """
+    Attribute a shared conversation's calls to the shortest cell that needs them.
+
+    Message m (0 is the opener) is needed by every cell with 2 * n_turns >= m;
+    it is billed to the shortest of them. Summary calls go with the next message.
+    """
+    segments = {n: [] for n in turn_counts}
+    held, message = [], 0
+    for call in calls:
+        held.append(call)
+        if call["stage"] in _CONVERSATION_STAGES:
+            owner = next((n for n in turn_counts if 2 * n >= message), turn_counts[-1])
+            segments[owner].extend(held)
+            held, message = [], message + 1
+    segments[turn_counts[-1]].extend(held)
+    return segments
+
+
+async def run_sweep(
+    spec: dict,
+    client: AsyncOpenAI | None = None,
+    api_key: str | None = None,
+    concurrency: int = 20,
+    rpm: float | None = None,
+    tpm: float | None = None,
+    model_limits: dict[str, tuple[float | None, float | None]] | None = None,
+    max_retries: int = 8,
+    max_concurrency: int = 15,
+    results_dir: str | None = None,
+    store_dir: str | None = None,
+    store_flush_every: int = 50,
+) -> dict:
+    """
+    Run every cell of a sweep spec, sharing baselines and conversation prefixes.
+
+    Args:
+        spec: Sweep spec (see module docstring)
+        client: Pre-built async client; overrides api_key
+        api_key: OpenAI API key (defaults to OPENAI_API_KEY)
+        concurrency: Maximum number of work units (a baseline survey or a
+            conversation with its post surveys) in flight at once
+        rpm: Requests-per-minute limit of each model (None for no limit)
+        tpm: Tokens-per-minute limit of each model (None for no limit)
+        model_limits: {model: (rpm, tpm)} overriding rpm/tpm for some models
+        max_retries: Retries per request on rate-limit/transient errors
+        max_concurrency: Maximum number of survey requests in flight per survey
+        results_dir: Directory to save each result to as JSON (None to skip)
+        store_dir: ResultsStore to append results to (None to skip)
+        store_flush_every: Results buffered per store segment
+
+    Returns:
+        Dict with "cells" (from expand_grid), "plan" (from plan_sweep),
+        "results" ({cell name: [result, ...]}) and "failures" (one
+        {"unit", "error"} per failed baseline or conversation)
+    """
+    name = spec.get("name", "sweep")
+    survey_mode = spec.get("survey_mode", "per_question")
+    check_survey_mode(survey_mode)
+    policy = make_context_policy(**spec["context_policy"]) if spec.get("context_policy") else None
+    personas = _variants(spec.get("persona", "non_weird"), PERSONAS, "persona")
+    topics = _variants(spec.get("topic", "society"), TOPICS, "topic")
+    cells = expand_grid(spec)
+    plan = plan_sweep(cells, survey_mode)
+    trials = spec.get("trials", 10)
+    print(
+        f"Sweep {name}: {len(cells)} cells x {trials} trials, "
+        f"~{plan['calls']} calls ({plan['calls_without_sharing']} without sharing)"
+    )
+
+    if client is None:
+        # Retries are handled by the rate limiters so that they share their budgets
+        client = AsyncOpenAI(api_key=api_key, max_retries=0)
+    limited_client = RateLimitedClient(
+        client, PerModelRateLimiter(model_limits, rpm=rpm, tpm=tpm, max_retries=max_retries)
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    store = ResultsStore(store_dir) if store_dir is not None else None
+    cells_by_group = {}
+    for cell in cells:
+        cells_by_group.setdefault(_group(cell), []).append(cell)
+
+    baselines = {}
+    conversations = {}
+    billed_baselines = set()
+    results = {cell["cell"]: [] for cell in cells}
+    failures = []
+    unstored = []
+
+    def flush_store() -> None:
+        if store is not None and unstored:
+            store.append(unstored)
+            unstored.clear()
+
+    def emit(group: tuple, j: int) -> None:
+        """Build the results of trial j of a group's cells once both halves are done."""
+        bot_model = group[0]
+        if (bot_model, j) not in baselines or (group, j) not in conversations:
+            return
+        baseline = baselines[(bot_model, j)]
+        shared = conversations.pop((group, j))
+        for cell in cells_by_group[group]:
+            n_turns = cell["n_turns"]
+            calls = shared["segments"][n_turns] + shared["post_calls"][n_turns]
+            if (bot_model, j) not in billed_baselines:
+                billed_baselines.add((bot_model, j))
+                calls = baseline["calls"] + calls
+            telemetry = Telemetry.from_calls(calls)
+            context = shared["context"]
+            summaries = None
+            if context is not None:
+                covered = context.covered(1 + 2 * n_turns)
+                summaries = {k: v for k, v in context.summaries.items() if k <= covered}
+            result = experiment_result(
+                baseline["scores"],
+                shared["posts"][n_turns],
+                shared["conversation"][:1 + 2 * n_turns],
+                {},
+                {"baseline": baseline["distributions"], "post": shared["distributions"][n_turns]},
+                telemetry,
+                summaries,
+                bot_model=bot_model, user_model=cell["user_model"], n_turns=n_turns,
+                survey_mode=survey_mode, measure_every=None, context_policy=policy,
+                sweep=name, cell=cell["cell"], persona=cell["persona"], topic=cell["topic"],
+            )
+            result["shared"] = {"baseline": f"{bot_model}#{j}", "conversation": f"{'/'.join(map(str, group))}#{j}"}
+            if results_dir is not None:
+                save_result(result, results_dir)
+            results[cell["cell"]].append(result)
+            unstored.append(result)
+        if len(unstored) >= store_flush_every:
+            flush_store()
+        print(f"Sweep trial {j} of {'/'.join(map(str, group))} finished")
+
+    async def baseline_unit(bot_model: str, j: int) -> None:
+        telemetry = Telemetry()
+        distributions = {}
+        async with semaphore:
+            try:
+                scores = await measure_wvs_async(
+                    limited_client, bot_model, conversation_history=[], max_concurrency=max_concurrency,
+                    survey_mode=survey_mode, on_distribution=distributions.__setitem__,
+                    telemetry=telemetry, stage="baseline_survey",
+                )
+            except Exception as e:
+                print(f"Baseline {bot_model}#{j} failed: {e!r}")
+                failures.append({"unit": f"baseline {bot_model}#{j}", "error": repr(e)})
+                return
+        baselines[(bot_model, j)] = {"scores": scores, "distributions": distributions, "calls": telemetry.calls}
+        for group in cells_by_group:
+            if group[0] == bot_model:
+                emit(group, j)
+
+    async def conversation_unit(group: tuple, j: int) -> None:
+        bot_model, user_model, persona, topic = group
+        turn_counts = plan["conversations"][group]
+        conversation_telemetry = Telemetry()
+        post_telemetry = {n: Telemetry() for n in turn_counts}
+        distributions = {n: {} for n in turn_counts}
+        posts = {}
+        context = ContextCompactor(policy) if policy is not None else None
+        messages = []
+        forks = []
+
+        async def post_survey(n_turns: int, prefix: list[dict]) -> None:
+            telemetry = post_telemetry[n_turns]
+            posts[n_turns] = await measure_wvs_async(
+                limited_client, bot_model, await compact_history_async(limited_client, context, prefix, telemetry),
+                max_concurrency=max_concurrency, survey_mode=survey_mode,
+                on_distribution=distributions[n_turns].__setitem__,
+                telemetry=telemetry, stage="post_survey",
+            )
+
+        def on_message(message: dict) -> None:
+            messages.append(message)
+            # Shorter cells end here: fork their post survey off the running conversation
+            for n_turns in turn_counts[:-1]:
+                if len(messages) == 1 + 2 * n_turns:
+                    forks.append(asyncio.create_task(post_survey(n_turns, list(messages))))
+
+        async with semaphore:
+            try:
+                conversation = await run_conversation_async(
+                    limited_client, bot_model, user_model, turn_counts[-1], on_message=on_message,
+                    survey_mode=survey_mode, max_concurrency=max_concurrency,
+                    telemetry=conversation_telemetry, context=context,
+                    persona=personas[persona], topic=topics[topic],
+                )
+                await asyncio.gather(post_survey(turn_counts[-1], conversation), *forks)
+            except Exception as e:
+                print(f"Conversation {'/'.join(map(str, group))}#{j} failed: {e!r}")
+                failures.append({"unit": f"conversation {'/'.join(map(str, group))}#{j}", "error": repr(e)})
+                return
+            finally:
+                for fork in forks:
+                    fork.cancel()
+        conversations[(group, j)] = {
+            "conversation": conversation,
+            "posts": posts,
+            "distributions": distributions,
+            "segments": _split_conversation_calls(conversation_telemetry.calls, turn_counts),
+            "post_calls": {n: telemetry.calls for n, telemetry in post_telemetry.items()},
+            "context": context,
+        }
+        emit(group, j)
+
+    # Round-robin over cells: the semaphore admits units in this order
+    units = []
+    for j in range(trials):
+        units.extend(baseline_unit(bot_model, j) for bot_model in plan["baselines"])
+        units.extend(conversation_unit(group, j) for group in cells_by_group)
+    try:
+        await asyncio.gather(*units)
+    finally:
+        flush_store()
+    return {"cells": cells, "plan": plan, "results": results, "failures": failures}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a multi-condition sweep from a JSON spec.")
+    parser.add_argument("spec", help="Path to the sweep spec JSON")
+    parser.add_argument("--concurrency", type=int, default=20, help="Work units in flight at once")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests-per-minute limit per model")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens-per-minute limit per model")
+    parser.add_argument("--max-retries", type=int, default=8)
+    parser.add_argument("--results-dir", default=None, help="Also save each result as JSON here")
+    parser.add_argument("--store", default="results_store", help="Columnar results store to append to")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the cells and shared work")
+    parser.add_argument("--backend", default="openai", choices=BACKENDS)
+    parser.add_argument("--base-url", default=None, help="OpenAI-compatible server URL (--backend local)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for --backend fake")
+    parser.add_argument("--fake-latency", type=float, default=0.5, help="Mean call latency for --backend fake")
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        spec = json.load(f)
+    if args.dry_run:
+        cells = expand_grid(spec)
+        plan = plan_sweep(cells, spec.get("survey_mode", "per_question"))
+        for cell in cells:
+            print(cell["cell"])
+        print(f"{len(plan['baselines'])} baseline pools, {len(plan['conversations'])} conversation groups, "
+              f"~{plan['calls']} calls ({plan['calls_without_sharing']} without sharing)")
+        return
+
+    if args.backend == "fake":
+        client = create_backend(
+            "fake", asynchronous=True, seed=args.seed, latency=args.fake_latency, latency_sigma=0.5
+        )
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+        client = create_backend(
+            args.backend,
+            asynchronous=True,
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            base_url=args.base_url,
+            max_retries=0,
+        )
+
+    outcome = asyncio.run(run_sweep(
+        spec,
+        client=client,
+        concurrency=args.concurrency,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        max_retries=args.max_retries,
+        results_dir=args.results_dir,
+        store_dir=args.store,
+    ))
+    for cell, cell_results in outcome["results"].items():
+        cost = summarize(cell_results)["overall"]["cost_total_usd"]
+        print(f"{cell}: {len(cell_results)} trials, ${cost:.4f}")
+    for failure in outcome["failures"]:
+        print(f"  {failure['unit']}: {failure['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Token, latency and cost telemetry for every LLM call in the experiment.
+
+Each call is recorded with its pipeline stage (opener, bot_turn, user_turn,
+summary, baseline_survey, trajectory_survey, post_survey), model, prompt/completion/
+cached tokens, latency, wait, retries and estimated cost. latency_s is the
+provider's time for the successful attempt; wait_s is the time spent in our
+own rate limiter before it (queueing for budget, 429 pauses, backoff sleeps
+and failed attempts). run_experiment stores the
+records of a trial under result["config"]["telemetry"], and `summarize` turns
+a set of results into p50/p95 latencies and per-trial token and cost figures.
+
+Usage from the command line:
+    python telemetry.py results/ --output telemetry_summary.json
+"""
+
+import argparse
+import contextvars
+import json
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+
+STAGES = ("opener", "bot_turn", "user_turn", "summary", "baseline_survey", "trajectory_survey", "post_survey")
+
+# USD per 1M tokens: (input, cached input, output). Unknown models are costed at 0.
+PRICES: dict[str, tuple[float, float, float]] = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+}
+# The Batch API bills at half the interactive price
+BATCH_DISCOUNT = 0.5
+
+# Retry counter and attempt latency of the call currently being tracked (per thread / asyncio task)
+_current_call: contextvars.ContextVar[dict | None] = contextvars.ContextVar("telemetry_call", default=None)
+
+
+def note_retry() -> None:
+    """Count a retry against the call currently being tracked, if any."""
+    call = _current_call.get()
+    if call is not None:
+        call["retries"] += 1
+
+
+def note_latency(latency: float) -> None:
+    """Record the latency of the successful attempt of the call being tracked, if any."""
+    call = _current_call.get()
+    if call is not None:
+        call["latency"] = latency
+
+
+def estimate_cost(
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    cached_tokens: int = 0,
+    batch: bool = False,
+) -> float:
+    """Estimated USD cost of one call; dated model names use their base model's price."""
+    price = PRICES.get(model)
+    if price is None:
+        base = next((name for name in sorted(PRICES, key=len, reverse=True) if model.startswith(f"{name}-")), None)
+        price = PRICES.get(base, (0.0, 0.0, 0.0))
+    input_price, cached_price, output_price = price
+    cost = (
+        (prompt_tokens - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + completion_tokens * output_price
+    ) / 1_000_000
+    return cost * BATCH_DISCOUNT if batch else cost
+
+
+def _usage_counts(usage) -> tuple[int, int, int]:
+    """(prompt, completion, cached) tokens from a usage object or dict."""
+    if usage is None:
+        return 0, 0, 0
+    get = usage.get if isinstance(usage, dict) else lambda name, default=None: getattr(usage, name, default)
+    details = get("prompt_tokens_details")
+    if isinstance(details, dict):
+        cached = details.get("cached_tokens") or 0
+    else:
+        cached = getattr(details, "cached_tokens", 0) or 0
+    return get("prompt_tokens", 0) or 0, get("completion_tokens", 0) or 0, cached
+
+
+class Telemetry:
+    """Per-trial collector of call records."""
+
+    def __init__(self):
+        self.calls: list[dict] = []
+
+    @classmethod
+    def from_calls(cls, calls: list[dict]) -> "Telemetry":
+        """Collector holding call records already made (e.g. shared between trials)."""
+        telemetry = cls()
+        telemetry.calls = list(calls)
+        return telemetry
+
+    def record(
+        self,
+        stage: str,
+        model: str,
+        usage,
+        latency: float | None,
+        retries: int = 0,
+        from_cache: bool = False,
+        batch: bool = False,
+        wait: float | None = None,
+    ) -> None:
+        """Add one call record; cache hits cost nothing and are flagged."""
+        prompt_tokens, completion_tokens, cached_tokens = _usage_counts(usage)
+        self.calls.append({
+            "stage": stage,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": cached_tokens,
+            "latency_s": latency,
+            "wait_s": wait,
+            "retries": retries,
+            "from_cache": from_cache,
+            "cost_usd": 0.0 if from_cache else estimate_cost(
+                model, prompt_tokens, completion_tokens, cached_tokens, batch=batch
+            ),
+        })
+
+    @contextmanager
+    def track(self, stage: str, model: str):
+        """
+        Time a call and record it on success.
+
+        The caller stores the response on the yielded dict under "response".
+        Retries made by runner.RateLimiter inside the block are counted, and
+        when the limiter reports the successful attempt's latency, the rest of
+        the elapsed time is recorded as wait_s instead of latency_s.
+        """
+        call = {"retries": 0, "response": None, "latency": None}
+        token = _current_call.set(call)
+        start = time.perf_counter()
+        try:
+            yield call
+        finally:
+            _current_call.reset(token)
+        elapsed = time.perf_counter() - start
+        latency = call["latency"] if call["latency"] is not None else elapsed
+        response = call["response"]
+        self.record(
+            stage,
+            model,
+            getattr(response, "usage", None),
+            latency,
+            retries=call["retries"],
+            from_cache=getattr(response, "from_cache", False),
+            wait=elapsed - latency,
+        )
+
+    def to_dict(self) -> dict:
+        """Telemetry block stored in result["config"]["telemetry"]."""
+        return {"calls": self.calls, "totals": _totals(self.calls)}
+
+
+def _totals(calls: list[dict]) -> dict:
+    return {
+        "calls": len(calls),
+        "prompt_tokens": sum(c["prompt_tokens"] for c in calls),
+        "completion_tokens": sum(c["completion_tokens"] for c in calls),
+        "cached_tokens": sum(c["cached_tokens"] for c in calls),
+        "retries": sum(c["retries"] for c in calls),
+        "cost_usd": sum(c["cost_usd"] for c in calls),
+    }
+
+
+def _percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+
+def summarize(results: list[dict]) -> dict:
+    """
+    Aggregate the telemetry of many trial results.
+
+    Args:
+        results: Trial result dicts (trials without telemetry are skipped)
+
+    Returns:
+        Dict with "trials", "overall" and per-"stages" figures: call counts,
+        p50/p95 latency and rate-limiter wait, tokens and cost per trial, cached-token share and retries
+    """
+    trials = [r["config"]["telemetry"]["calls"] for r in results if "telemetry" in r.get("config", {})]
+    n_trials = len(trials)
+    calls = [call for trial in trials for call in trial]
+
+    def aggregate(selected: list[dict]) -> dict:
+        latencies = [c["latency_s"] for c in selected if c["latency_s"] is not None and not c["from_cache"]]
+        waits = [c["wait_s"] for c in selected if c.get("wait_s") is not None and not c["from_cache"]]
+        totals = _totals(selected)
+        prompt_tokens = totals["prompt_tokens"]
+        return {
+            "calls_per_trial": totals["calls"] / n_trials if n_trials else 0.0,
+            "latency_p50_s": _percentile(latencies, 50),
+            "latency_p95_s": _percentile(latencies, 95),
+            "wait_p50_s": _percentile(waits, 50),
+            "wait_p95_s": _percentile(waits, 95),
+            "prompt_tokens_per_trial": prompt_tokens / n_trials if n_trials else 0.0,
+            "completion_tokens_per_trial": totals["completion_tokens"] / n_trials if n_trials else 0.0,
+            "cached_token_share": totals["cached_tokens"] / prompt_tokens if prompt_tokens else 0.0,
+            "cache_hits": sum(c["from_cache"] for c in selected),
+            "retries": totals["retries"],
+            "cost_per_trial_usd": totals["cost_usd"] / n_trials if n_trials else 0.0,
+            "cost_total_usd": totals["cost_usd"],
+        }
+
+    stages = sorted({c["stage"] for c in calls}, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES))
+    return {
+        "trials": n_trials,
+        "overall": aggregate(calls),
+        "stages": {stage: aggregate([c for c in calls if c["stage"] == stage]) for stage in stages},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Summarize call telemetry of saved trial results.")
+    parser.add_argument("results_dir", nargs="?", default="results")
+    parser.add_argument("--output", default=None, help="Write the summary JSON here")
+    args = parser.parse_args()
+
+    results = []
+    for filename in sorted(os.listdir(args.results_dir)):
+        if filename.endswith(".json"):
+            with open(os.path.join(args.results_dir, filename)) as f:
+                results.append(json.load(f))
+    summary = summarize(results)
+    text = json.dumps(summary, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
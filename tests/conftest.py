@@ -0,0 +1,34 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import create_backend
+from runner import run_trials
+
+
+@pytest.fixture
+def crashed_log(tmp_path):
+    """Checkpoint log of a run of 4 two-turn trials killed after 40 of its 140 calls."""
+    path = str(tmp_path / "log.jsonl")
+    client = create_backend("fake", asynchronous=True, seed=0, latency=0.01)
+
+    async def run() -> None:
+        task = asyncio.ensure_future(
+            run_trials(4, concurrency=4, n_turns=2, client=client, results_dir=None, checkpoint_path=path)
+        )
+        while client.calls < 40:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    # A kill mid-write leaves a truncated final line
+    with open(path, "a") as f:
+        f.write('{"trial": "')
+    return path
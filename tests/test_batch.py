@@ -0,0 +1,67 @@
+import glob
+import os
+
+from batch import FakeBatchClient, run_batch, run_trials_batch
+from prompts import WVS_QUESTIONS
+
+
+def test_run_trials_batch_end_to_end(tmp_path):
+    client = FakeBatchClient(seed=0, fail_ids={"1:opener", "2:bot1"})
+    outcome = run_trials_batch(
+        client, n=5, n_turns=2, workdir=str(tmp_path / "batches"), results_dir=str(tmp_path / "results"),
+        poll_interval=0,
+    )
+
+    assert sorted(f["trial"] for f in outcome["failures"]) == [1, 2]
+    assert len(outcome["results"]) == 3
+    assert len(os.listdir(tmp_path / "results")) == 3
+    for result in outcome["results"]:
+        assert set(result["baseline"]) == set(result["post"]) == {q["id"] for q in WVS_QUESTIONS}
+        assert [m["role"] for m in result["conversation"]] == ["user", "assistant", "user", "assistant", "user"]
+        assert result["config"]["execution"] == "batch"
+        # 15 baseline + opener + 2 turns x 2 + 15 post
+        assert result["config"]["telemetry"]["totals"]["calls"] == 35
+
+
+def test_run_trials_batch_batched_survey(tmp_path):
+    outcome = run_trials_batch(
+        FakeBatchClient(seed=0), n=3, n_turns=1, survey_mode="batched",
+        workdir=str(tmp_path / "batches"), results_dir=None, poll_interval=0,
+    )
+
+    assert not outcome["failures"]
+    assert all(len(r["post"]) == len(WVS_QUESTIONS) for r in outcome["results"])
+
+
+def test_steps_are_split_over_jobs(tmp_path):
+    # Each trial makes 16 requests in the first step, so 4 trials need 3 jobs of at most 25
+    client = FakeBatchClient(seed=0, max_requests=25)
+    outcome = run_trials_batch(
+        client, n=4, n_turns=1, workdir=str(tmp_path), results_dir=None, poll_interval=0, max_requests=25,
+    )
+
+    assert not outcome["failures"]
+    assert len(outcome["results"]) == 4
+    inputs = glob.glob(str(tmp_path / "run_*" / "step_00_baseline_opener.part*.input.jsonl"))
+    assert len(inputs) == 3
+    for path in inputs:
+        with open(path) as f:
+            assert len(f.readlines()) <= 25
+
+
+def test_oversized_job_fails_only_its_requests(tmp_path):
+    client = FakeBatchClient(seed=0, max_requests=2)
+    requests = {str(i): {"model": "gpt-4o", "messages": [{"role": "user", "content": "hi"}]} for i in range(3)}
+
+    outputs = run_batch(client, requests, str(tmp_path), "step", poll_interval=0, max_requests=3)
+
+    assert all(isinstance(output, str) and "failed" in output for output in outputs.values())
+
+
+def test_expired_job_keeps_finished_outputs(tmp_path):
+    client = FakeBatchClient(seed=0, expire_ids={"0:bot2"})
+    outcome = run_trials_batch(client, n=3, n_turns=2, workdir=str(tmp_path), results_dir=None, poll_interval=0)
+
+    assert [f["trial"] for f in outcome["failures"]] == [0]
+    assert "expired" in outcome["failures"][0]["error"]
+    assert len(outcome["results"]) == 2
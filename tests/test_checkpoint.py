@@ -0,0 +1,50 @@
+import asyncio
+import json
+from collections import Counter
+
+from backends import create_backend
+from checkpoint import count_missing_steps, load_trials, unfinished_trials
+from prompts import WVS_QUESTIONS
+from runner import run_trials
+
+
+def step_keys(path: str) -> list[tuple]:
+    """One key per logged step: a repeated key means a step was run twice."""
+    keys = []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            detail = record.get("question", record.get("index"))
+            keys.append((record["trial"], record["event"], detail))
+    return keys
+
+
+def test_resume_finishes_crashed_trials_without_repeating_steps(crashed_log):
+    partial = unfinished_trials(crashed_log)
+    assert len(partial) == 4
+    assert all(not trial["post"] for trial in partial.values())
+
+    client = create_backend("fake", asynchronous=True, seed=0)
+    outcome = asyncio.run(run_trials(
+        0, n_turns=2, client=client, results_dir=None, checkpoint_path=crashed_log, resume=True,
+    ))
+
+    assert not outcome["failures"]
+    assert sorted(r["trial_id"] for r in outcome["results"]) == sorted(partial)
+    assert not unfinished_trials(crashed_log)
+    duplicates = [key for key, count in Counter(step_keys(crashed_log)).items() if count > 1]
+    assert not duplicates
+    questions = {q["id"] for q in WVS_QUESTIONS}
+    for result in outcome["results"]:
+        assert set(result["baseline"]) == set(result["post"]) == questions
+        assert len(result["conversation"]) == 5
+    # The resumed run made only the calls the crash left
+    assert client.calls == sum(count_missing_steps(trial) for trial in partial.values())
+    results = {r["trial_id"]: r for r in outcome["results"]}
+    for trial_id, trial in load_trials(crashed_log).items():
+        assert trial["done"]
+        assert trial["conversation"] == results[trial_id]["conversation"]
+        assert trial["post"] == results[trial_id]["post"]
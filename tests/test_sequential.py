@@ -0,0 +1,73 @@
+import asyncio
+import random
+
+import pytest
+
+from backends import create_backend
+from checkpoint import unfinished_trials
+from runner import run_trials
+from sequential import DriftMonitor
+
+QUESTION = {"id": "q", "scale_min": 1, "scale_max": 10}
+
+
+def simulate(method: str, drift: list[int], weights: list[float], n_trials: int, seed: int) -> DriftMonitor:
+    """DriftMonitor fed n_trials drifts drawn from `drift` with `weights`."""
+    rng = random.Random(seed)
+    monitor = DriftMonitor(method=method, min_trials=10, planned_trials=n_trials, questions=[QUESTION])
+    for value in rng.choices(drift, weights, k=n_trials):
+        monitor.update({"baseline": {"q": 0}, "post": {"q": value}})
+    return monitor
+
+
+@pytest.mark.parametrize("method", ["bernstein", "asymptotic"])
+def test_confidence_sequence_covers_true_mean_across_looks(method):
+    drift, weights = [-3, -1, 0, 1, 4], [0.1, 0.2, 0.4, 0.2, 0.1]
+    true_mean = sum(d * w for d, w in zip(drift, weights))
+    misses = 0
+    for seed in range(200):
+        monitor = simulate(method, drift, weights, 300, seed)
+        # The interval is the running intersection, so it covers the mean at
+        # the end only if every interval along the way did
+        low, high = monitor.sequences["q"].interval
+        misses += not low <= true_mean <= high
+    assert misses / 200 <= 0.05 + 0.03
+
+
+@pytest.mark.parametrize("method", ["bernstein", "asymptotic"])
+def test_monitor_stops_on_clear_effect(method):
+    monitor = DriftMonitor(method=method, min_trials=10, planned_trials=500, questions=[QUESTION])
+    rng = random.Random(0)
+    stopped_at = None
+    for trial in range(1, 501):
+        monitor.update({"baseline": {"q": 3}, "post": {"q": 3 + rng.choice([1, 2, 2, 3])}})
+        if monitor.should_stop(0.5):
+            stopped_at = trial
+            break
+
+    assert stopped_at is not None and stopped_at >= 10
+    low, high = monitor.sequences["q"].interval
+    assert 0 < low <= 2.0 <= high and high - low <= 1.0
+
+
+def test_monitor_waits_for_min_trials():
+    monitor = DriftMonitor(min_trials=10, questions=[QUESTION])
+    for _ in range(9):
+        monitor.update({"baseline": {"q": 5}, "post": {"q": 5}})
+    assert not monitor.should_stop(100.0)
+    monitor.update({"baseline": {"q": 5}, "post": {"q": 5}})
+    assert monitor.should_stop(100.0)
+
+
+def test_resumed_trials_finish_after_early_stop(crashed_log):
+    partial = unfinished_trials(crashed_log)
+    outcome = asyncio.run(run_trials(
+        20, concurrency=1, n_turns=2, client=create_backend("fake", asynchronous=True, seed=0),
+        results_dir=None, checkpoint_path=crashed_log, resume=True,
+        target_half_width=100.0, min_trials=1,
+    ))
+
+    # The first finished trial stops the run; the other resumed trials still finish
+    assert outcome["stopped_early"]
+    assert sorted(r["trial_id"] for r in outcome["results"]) == sorted(partial)
+    assert not unfinished_trials(crashed_log)
@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+
+from runner import save_result
+from store import MAX_SEGMENTS, ResultsStore, migrate_json_results
+
+
+def make_result(i: int) -> dict:
+    # Every third trial skips a question, so segments have different columns
+    questions = ["a", "b", "c"] if i % 3 else ["a", "b"]
+    return {
+        "trial_id": f"trial_{i}",
+        "baseline": {q: float((i + k) % 10 + 1) for k, q in enumerate(questions)},
+        "post": {q: float((2 * i + k) % 10 + 1) for k, q in enumerate(questions)},
+        "conversation": [{"role": "user", "content": f"hello {i}"}, {"role": "assistant", "content": "hi"}],
+        "config": {"bot_model": "gpt-4o", "n_turns": 1 + i % 2, "telemetry": {"calls": [], "totals": {"calls": i}}},
+        "trajectory": [{"turn": 0, "scores": {"a": float(i)}}],
+    }
+
+
+def test_round_trip_through_compaction(tmp_path):
+    store = ResultsStore(str(tmp_path / "store"))
+    results = [make_result(i) for i in range(2 * (MAX_SEGMENTS + 4))]
+    for start in range(0, len(results), 2):
+        store.append(results[start:start + 2])
+        assert len(os.listdir(tmp_path / "store" / "segments")) <= MAX_SEGMENTS
+
+    # A fresh instance reads only what was written to disk
+    store = ResultsStore(str(tmp_path / "store"))
+    scores = store.load_scores()
+    assert scores.trial_ids.tolist() == [r["trial_id"] for r in results]
+    for row, result in enumerate(results):
+        for column, q in enumerate(scores.question_ids):
+            assert np.isnan(scores.baseline[row, column]) == (q not in result["baseline"])
+            if q in result["baseline"]:
+                assert scores.baseline[row, column] == result["baseline"][q]
+                assert scores.post[row, column] == result["post"][q]
+        assert store.get_trial(result["trial_id"]) == result
+
+
+def test_migrate_skips_trials_already_in_store(tmp_path):
+    results_dir = str(tmp_path / "results")
+    store = ResultsStore(str(tmp_path / "store"))
+    saved = []
+    for i in range(5):
+        result = {k: v for k, v in make_result(i).items() if k != "trial_id"}
+        save_result(result, results_dir)
+        saved.append(result)
+    # As runner.run_trials does with a store: the same results also go to the store
+    store.append(saved[:3])
+
+    assert migrate_json_results(results_dir, store) == 2
+    assert migrate_json_results(results_dir, store) == 0
+    assert len(store) == 5
+    assert sorted(store.load_scores().trial_ids.tolist()) == sorted(r["trial_id"] for r in saved)